@@ -14,10 +14,14 @@ import sys
 import asyncio
 import json
 import random
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Optional, List, Literal
 import sqlite3
 import time
+import heapq
+import bisect
+from contextlib import asynccontextmanager
+from collections import OrderedDict
 import aiosqlite  # 使用異步SQLite
 
 # ========== 設定 ==========
@@ -68,7 +72,32 @@ intents.reactions = True
 intents.members = True
 intents.presences = True
 
-bot = commands.Bot(
+class AlbionBot(commands.Bot):
+    """機械人主體（負責啟動與關閉時的資源管理）"""
+    
+    async def setup_hook(self):
+        await db_pool.open()
+        await init_db()
+        await message_router.load()
+        await score_board.load()
+        query_log_writer.start()
+        timer_scheduler.start()
+        # 保留參照，避免復原工作在執行前被回收
+        self.recovery_task = asyncio.create_task(recover_timers())
+    
+    async def close(self):
+        # 先讓狀態角色寫入最後一批並送出排隊中的編輯，再關閉 HTTP 連線與資料庫
+        recovery_task = getattr(self, "recovery_task", None)
+        if recovery_task is not None and not recovery_task.done():
+            recovery_task.cancel()
+        timer_scheduler.stop()
+        await state_actors.close_all()
+        await embed_editor.stop()
+        await query_log_writer.stop()
+        await super().close()
+        await db_pool.close()
+
+bot = AlbionBot(
     command_prefix='!',
     intents=intents,
     help_command=None,
@@ -79,10 +108,132 @@ tree = bot.tree
 
 # ========== 資料庫設定 ==========
 DB_NAME = "bot_data.db"
+DB_READER_COUNT = int(os.getenv("DB_READER_COUNT", "4"))  # 唯讀連線數量
+
+# 資料庫效能/耐久性設定檔（以環境變數 DB_PROFILE 選擇）
+DB_PROFILES = {
+    # WAL + synchronous=NORMAL：讀寫互不阻塞，提交時不必每次 fsync
+    "fast": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 268435456,  # 256MB
+        "cache_size": -65536,    # 64MB
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000
+    },
+    # 傳統回滾日誌 + synchronous=FULL：每次提交完整寫入磁碟
+    "safe": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "mmap_size": 0,
+        "cache_size": -16384,    # 16MB
+        "temp_store": "DEFAULT",
+        "busy_timeout": 5000
+    }
+}
+DB_PROFILE = os.getenv("DB_PROFILE", "fast").lower()
+if DB_PROFILE not in DB_PROFILES:
+    print(f"⚠️ 未知的資料庫設定檔 {DB_PROFILE}，改用 fast")
+    DB_PROFILE = "fast"
+
+async def apply_db_profile(conn, profile: str = DB_PROFILE, set_journal_mode: bool = True):
+    """套用資料庫 PRAGMA 設定檔"""
+    settings = DB_PROFILES[profile]
+    
+    if set_journal_mode:
+        await conn.execute(f"PRAGMA journal_mode = {settings['journal_mode']}")
+    
+    await conn.execute(f"PRAGMA synchronous = {settings['synchronous']}")
+    await conn.execute(f"PRAGMA mmap_size = {settings['mmap_size']}")
+    await conn.execute(f"PRAGMA cache_size = {settings['cache_size']}")
+    await conn.execute(f"PRAGMA temp_store = {settings['temp_store']}")
+    await conn.execute(f"PRAGMA busy_timeout = {settings['busy_timeout']}")
+
+class DatabasePool:
+    """全域資料庫連線池：一個寫入連線 + 多個唯讀連線，啟動時建立、關機時關閉"""
+    
+    def __init__(self, db_name: str, reader_count: int = DB_READER_COUNT):
+        self.db_name = db_name
+        self.reader_count = max(1, reader_count)
+        self._writer = None
+        self._writer_lock = asyncio.Lock()
+        self._writer_owner = None
+        self._readers = None
+        self._all_readers = []
+    
+    @property
+    def is_open(self):
+        return self._writer is not None
+    
+    async def open(self):
+        """建立所有連線"""
+        if self.is_open:
+            return
+        
+        self._writer = await aiosqlite.connect(self.db_name)
+        await apply_db_profile(self._writer)
+        
+        self._readers = asyncio.Queue()
+        for _ in range(self.reader_count):
+            conn = await aiosqlite.connect(self.db_name)
+            # journal_mode 為整個資料庫的設定，已由寫入連線套用
+            await apply_db_profile(conn, set_journal_mode=False)
+            await conn.execute("PRAGMA query_only = ON")
+            self._all_readers.append(conn)
+            self._readers.put_nowait(conn)
+        
+        print(f"✅ 資料庫連線池已建立 (寫入: 1, 唯讀: {self.reader_count})")
+    
+    async def close(self):
+        """關閉所有連線"""
+        if not self.is_open:
+            return
+        
+        async with self._writer_lock:
+            if self._writer.in_transaction:
+                await self._writer.rollback()
+            await self._writer.close()
+            self._writer = None
+        
+        for conn in self._all_readers:
+            await conn.close()
+        self._all_readers = []
+        self._readers = None
+        
+        print("✅ 資料庫連線池已關閉")
+    
+    @asynccontextmanager
+    async def writer(self):
+        """取得寫入連線（同一任務可重入，未提交的變更會在離開時回滾）"""
+        task = asyncio.current_task()
+        if self._writer_owner is task:
+            yield self._writer
+            return
+        
+        async with self._writer_lock:
+            self._writer_owner = task
+            try:
+                yield self._writer
+            finally:
+                self._writer_owner = None
+                if self._writer is not None and self._writer.in_transaction:
+                    await self._writer.rollback()
+    
+    @asynccontextmanager
+    async def reader(self):
+        """取得唯讀連線"""
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            if self._readers is not None:
+                self._readers.put_nowait(conn)
+
+db_pool = DatabasePool(DB_NAME)
 
 async def init_db():
     """初始化資料庫"""
-    async with aiosqlite.connect(DB_NAME) as conn:
+    async with db_pool.writer() as conn:
         await conn.execute('''
         CREATE TABLE IF NOT EXISTS users (
             user_id INTEGER NOT NULL,
@@ -189,22 +340,1013 @@ async def init_db():
         ''')
         
         await conn.commit()
-        print("✅ 資料庫初始化完成")
+        
+        await run_migrations(conn)
+        
+        async with conn.execute("PRAGMA journal_mode") as cursor:
+            journal_mode = (await cursor.fetchone())[0]
+        
+        print(f"✅ 資料庫初始化完成 (設定檔: {DB_PROFILE}, journal_mode: {journal_mode})")
+
+# ========== 資料庫遷移 ==========
+
+async def migrate_hot_path_indexes(conn):
+    """為反應事件與排行榜的熱點查詢建立索引"""
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_events_signup_message ON evaluation_events(signup_message_id)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_events_profession_message ON evaluation_events(profession_message_id)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_events_rating_message ON evaluation_events(rating_message_id)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_giveaways_message ON giveaways(message_id)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_guild_score ON users(guild_id, current_score)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_transfers_guild_time ON score_transfers(guild_id, timestamp)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_query_logs_guild_time ON query_logs(guild_id, timestamp)")
+
+async def migrate_event_participants(conn):
+    """將 evaluation_events.participants JSON 拆分為 event_participants 表"""
+    await conn.execute('''
+    CREATE TABLE IF NOT EXISTS event_participants (
+        event_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        signed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (event_id, user_id)
+    )
+    ''')
+    
+    async with conn.execute("SELECT id, participants, start_time FROM evaluation_events") as cursor:
+        events = await cursor.fetchall()
+    
+    rows = []
+    for event_id, participants_json, start_time in events:
+        participants = json.loads(participants_json) if participants_json else []
+        for user_id in participants:
+            rows.append((event_id, int(user_id), start_time))
+    
+    await conn.executemany(
+        "INSERT OR IGNORE INTO event_participants (event_id, user_id, signed_at) VALUES (?, ?, ?)",
+        rows
+    )
+
+async def migrate_attendance(conn):
+    """將 users.activity_stats JSON 拆分為 attendance 表"""
+    await conn.execute('''
+    CREATE TABLE IF NOT EXISTS attendance (
+        guild_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        period_id TEXT NOT NULL,
+        total INTEGER DEFAULT 0,
+        attended INTEGER DEFAULT 0,
+        PRIMARY KEY (guild_id, user_id, period_id)
+    )
+    ''')
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_attendance_period ON attendance(guild_id, period_id, attended)")
+    
+    async with conn.execute("SELECT guild_id, user_id, activity_stats FROM users WHERE activity_stats IS NOT NULL AND activity_stats != '{}'") as cursor:
+        users = await cursor.fetchall()
+    
+    rows = []
+    for guild_id, user_id, activity_str in users:
+        activity_stats = json.loads(activity_str) if activity_str else {}
+        for period_id, data in activity_stats.items():
+            rows.append((guild_id, user_id, period_id, data.get("total", 0), data.get("attended", 0)))
+    
+    await conn.executemany(
+        "INSERT OR IGNORE INTO attendance (guild_id, user_id, period_id, total, attended) VALUES (?, ?, ?, ?, ?)",
+        rows
+    )
+
+async def migrate_giveaway_entries(conn):
+    """將 giveaways.participants JSON 拆分為 giveaway_entries 表並新增參與人數欄位"""
+    await conn.execute('''
+    CREATE TABLE IF NOT EXISTS giveaway_entries (
+        giveaway_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        entered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (giveaway_id, user_id)
+    )
+    ''')
+    await conn.execute("ALTER TABLE giveaways ADD COLUMN entry_count INTEGER DEFAULT 0")
+    
+    async with conn.execute("SELECT id, participants, created_at FROM giveaways") as cursor:
+        giveaways = await cursor.fetchall()
+    
+    rows = []
+    for giveaway_id, participants_json, created_at in giveaways:
+        participants = json.loads(participants_json) if participants_json else []
+        for user_id in participants:
+            rows.append((giveaway_id, int(user_id), created_at))
+    
+    await conn.executemany(
+        "INSERT OR IGNORE INTO giveaway_entries (giveaway_id, user_id, entered_at) VALUES (?, ?, ?)",
+        rows
+    )
+    await conn.execute('''
+        UPDATE giveaways 
+        SET entry_count = (SELECT COUNT(*) FROM giveaway_entries WHERE giveaway_id = giveaways.id)
+    ''')
+
+async def migrate_evaluation_ratings(conn):
+    """將 evaluation_events.ratings JSON 拆分為 evaluation_ratings 歷史表"""
+    await conn.execute('''
+    CREATE TABLE IF NOT EXISTS evaluation_ratings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        rater_id INTEGER,
+        rating TEXT NOT NULL,
+        rated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_ratings_event_user_time ON evaluation_ratings(event_id, user_id, rated_at)")
+    
+    async with conn.execute("SELECT id, ratings FROM evaluation_events WHERE ratings IS NOT NULL AND ratings != '{}'") as cursor:
+        events = await cursor.fetchall()
+    
+    rows = []
+    for event_id, ratings_json in events:
+        ratings = json.loads(ratings_json) if ratings_json else {}
+        for user_id, rating_list in ratings.items():
+            for entry in rating_list:
+                # 舊資料的時間為本地 isoformat，轉為與 CURRENT_TIMESTAMP 相同的 UTC 格式
+                try:
+                    rated_at = utc_timestamp(datetime.fromisoformat(entry["time"]))
+                except (KeyError, TypeError, ValueError):
+                    rated_at = None
+                rows.append((event_id, int(user_id), entry.get("rater"), entry["rating"], rated_at))
+    
+    await conn.executemany(
+        "INSERT INTO evaluation_ratings (event_id, user_id, rater_id, rating, rated_at) VALUES (?, ?, ?, ?, ?)",
+        rows
+    )
+
+async def migrate_event_prize(conn):
+    """活動獎品改存資料庫，重新啟動後仍可完成簽到結算"""
+    await conn.execute("ALTER TABLE evaluation_events ADD COLUMN prize TEXT")
+
+async def migrate_period_events(conn):
+    """每個伺服器每個半月期的活動數計數表"""
+    await conn.execute('''
+    CREATE TABLE IF NOT EXISTS period_events (
+        guild_id INTEGER NOT NULL,
+        period_id TEXT NOT NULL,
+        event_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (guild_id, period_id)
+    )
+    ''')
+    # 舊資料沒有逐場紀錄，以該期出席紀錄中最大的 total 作為估計值
+    await conn.execute('''
+        INSERT OR IGNORE INTO period_events (guild_id, period_id, event_count)
+        SELECT guild_id, period_id, MAX(total) FROM attendance GROUP BY guild_id, period_id
+    ''')
+
+async def migrate_stats_indexes(conn):
+    """活動統計的覆蓋索引：計數與最近活動只需掃描索引"""
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_events_guild_time ON evaluation_events(guild_id, start_time, is_active)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_giveaways_guild_active ON giveaways(guild_id, is_active)")
+
+async def migrate_signup_settled(conn):
+    """簽到結算標記：與結算在同一交易中寫入，避免重新啟動後重複發放"""
+    await conn.execute("ALTER TABLE evaluation_events ADD COLUMN signup_settled_at TIMESTAMP")
+    # 已建立評核訊息、已寫入預設評級，或無人簽到且已過簽到時間的舊活動都視為已結算
+    await conn.execute('''
+        UPDATE evaluation_events SET signup_settled_at = CURRENT_TIMESTAMP
+        WHERE rating_message_id IS NOT NULL
+           OR COALESCE(default_rated, '[]') != '[]'
+           OR (signup_end_time <= datetime('now', 'localtime')
+               AND NOT EXISTS (SELECT 1 FROM event_participants p WHERE p.event_id = evaluation_events.id))
+    ''')
+
+async def migrate_attendance_ranking(conn):
+    """出席排名表：每個伺服器每個期間（半月期與 "all"）一列一用戶，依排名順序建立索引"""
+    # 排名以名稱排序，補上舊資料中缺少的名稱（與新用戶的預設名稱一致）
+    await conn.execute("UPDATE users SET username = '用戶' || user_id WHERE username IS NULL")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_guild_name ON users(guild_id, username, user_id)")
+    
+    await conn.execute('''
+    CREATE TABLE IF NOT EXISTS attendance_ranking (
+        guild_id INTEGER NOT NULL,
+        period_id TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        username TEXT NOT NULL,
+        attended INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (guild_id, period_id, user_id)
+    )
+    ''')
+    await conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_attendance_ranking_order 
+        ON attendance_ranking(guild_id, period_id, attended DESC, username, user_id)
+    ''')
+    
+    await conn.execute('''
+        INSERT OR IGNORE INTO attendance_ranking (guild_id, period_id, user_id, username, attended)
+        SELECT a.guild_id, a.period_id, a.user_id, u.username, a.attended
+        FROM attendance a
+        JOIN users u ON u.guild_id = a.guild_id AND u.user_id = a.user_id
+        WHERE a.attended > 0
+    ''')
+    await conn.execute('''
+        INSERT OR IGNORE INTO attendance_ranking (guild_id, period_id, user_id, username, attended)
+        SELECT a.guild_id, 'all', a.user_id, u.username, SUM(a.attended)
+        FROM attendance a
+        JOIN users u ON u.guild_id = a.guild_id AND u.user_id = a.user_id
+        WHERE a.attended > 0
+        GROUP BY a.guild_id, a.user_id
+    ''')
+
+# 依版本順序執行的遷移步驟：(版本, 說明, 遷移函數)
+SCHEMA_MIGRATIONS = [
+    (1, "熱點查詢索引", migrate_hot_path_indexes),
+    (2, "活動參與者表", migrate_event_participants),
+    (3, "出席統計表", migrate_attendance),
+    (4, "抽獎參與表", migrate_giveaway_entries),
+    (5, "評核歷史表", migrate_evaluation_ratings),
+    (6, "活動獎品欄位", migrate_event_prize),
+    (7, "半月期活動計數表", migrate_period_events),
+    (8, "活動統計索引", migrate_stats_indexes),
+    (9, "簽到結算標記", migrate_signup_settled),
+    (10, "出席排名表", migrate_attendance_ranking),
+]
+
+async def run_migrations(conn):
+    """執行尚未套用的資料庫遷移（每個版本在單一交易內完成）"""
+    await conn.execute('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    await conn.commit()
+    
+    async with conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version") as cursor:
+        current_version = (await cursor.fetchone())[0]
+    
+    for version, description, migration in SCHEMA_MIGRATIONS:
+        if version <= current_version:
+            continue
+        
+        try:
+            await conn.execute("BEGIN")
+            await migration(conn)
+            await conn.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)", (version, description))
+            await conn.commit()
+        except Exception:
+            await conn.rollback()
+            print(f"❌ 資料庫遷移失敗: v{version} {description}")
+            raise
+        
+        current_version = version
+        print(f"✅ 資料庫遷移完成: v{version} {description}")
+
+# ========== 查詢日誌（背景批次寫入） ==========
+QUERY_LOG_QUEUE_SIZE = int(os.getenv("QUERY_LOG_QUEUE_SIZE", "10000"))  # 佇列上限，滿了就丟棄
+QUERY_LOG_FLUSH_MS = int(os.getenv("QUERY_LOG_FLUSH_MS", "500"))         # 最長寫入間隔
+QUERY_LOG_BATCH_SIZE = int(os.getenv("QUERY_LOG_BATCH_SIZE", "200"))     # 每批最多筆數
+
+class QueryLogWriter:
+    """查詢日誌寫入器：指令只把日誌放進佇列，由背景任務以 executemany 批次寫入"""
+    
+    _STOP = object()  # 停止標記：排在剩餘日誌之後，背景任務寫完前面的日誌才結束
+    
+    def __init__(self, maxsize=QUERY_LOG_QUEUE_SIZE, flush_ms=QUERY_LOG_FLUSH_MS, batch_size=QUERY_LOG_BATCH_SIZE):
+        self.queue = asyncio.Queue(maxsize)
+        self.flush_interval = flush_ms / 1000
+        self.batch_size = max(1, batch_size)
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._batch = []
+        self._task = None
+    
+    def submit(self, row):
+        """放入一筆日誌（不等待）"""
+        try:
+            self.queue.put_nowait(row)
+        except asyncio.QueueFull:
+            self.dropped += 1
+    
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """停止背景任務並寫入剩餘日誌（不中斷進行中的寫入）"""
+        if self._task is not None:
+            await self.queue.put(self._STOP)
+            await self._task
+            self._task = None
+        
+        while not self.queue.empty():
+            self._batch.append(self.queue.get_nowait())
+        await self._flush()
+        
+        print(f"✅ 查詢日誌已寫入 (已寫入: {self.written}, 丟棄: {self.dropped}, 失敗: {self.failed})")
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            row = await self.queue.get()
+            stopping = row is self._STOP
+            if not stopping:
+                self._batch.append(row)
+            deadline = loop.time() + self.flush_interval
+            
+            while not stopping and len(self._batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if row is self._STOP:
+                    stopping = True
+                else:
+                    self._batch.append(row)
+            
+            await self._flush()
+            if stopping:
+                return
+    
+    async def _flush(self):
+        if not self._batch:
+            return
+        
+        batch, self._batch = self._batch, []
+        try:
+            async with db_pool.writer() as conn:
+                await conn.executemany(
+                    "INSERT INTO query_logs (query_type, user_id, parameters, guild_id, timestamp) VALUES (?, ?, ?, ?, ?)",
+                    batch
+                )
+                await conn.commit()
+            self.written += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            print(f"寫入查詢日誌錯誤: {e}")
+
+query_log_writer = QueryLogWriter()
 
 async def log_query(query_type: str, user_id: int, parameters: dict, guild_id: int = 0):
-    """記錄查詢日誌"""
-    async with aiosqlite.connect(DB_NAME) as conn:
-        await conn.execute(
-            "INSERT INTO query_logs (query_type, user_id, parameters, guild_id) VALUES (?, ?, ?, ?)",
-            (query_type, user_id, json.dumps(parameters), guild_id)
+    """記錄查詢日誌（放入背景寫入佇列，不影響指令回應時間）"""
+    timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    query_log_writer.submit((query_type, user_id, json.dumps(parameters), guild_id, timestamp))
+
+# ========== 訊息路由索引 ==========
+
+class MessageRouter:
+    """訊息ID → (類型, 活動/抽獎ID, 伺服器ID)，讓反應事件不必逐表查詢"""
+    
+    def __init__(self):
+        self.routes = {}
+    
+    def register(self, message_id, kind, target_id, guild_id):
+        if message_id:
+            self.routes[message_id] = (kind, target_id, guild_id)
+    
+    def unregister(self, *message_ids):
+        for message_id in message_ids:
+            self.routes.pop(message_id, None)
+    
+    def get(self, message_id):
+        return self.routes.get(message_id)
+    
+    async def load(self):
+        """從資料庫載入所有進行中的活動與抽獎"""
+        self.routes.clear()
+        
+        async with db_pool.reader() as conn:
+            async with conn.execute("""
+                SELECT id, signup_message_id, profession_message_id, rating_message_id, guild_id 
+                FROM evaluation_events 
+                WHERE is_active = 1
+            """) as cursor:
+                events = await cursor.fetchall()
+            
+            async with conn.execute("SELECT id, message_id, guild_id FROM giveaways WHERE is_active = 1") as cursor:
+                giveaways = await cursor.fetchall()
+        
+        for event_id, signup_message_id, profession_message_id, rating_message_id, guild_id in events:
+            self.register(signup_message_id, "signup", event_id, guild_id)
+            self.register(profession_message_id, "profession", event_id, guild_id)
+            self.register(rating_message_id, "rating", event_id, guild_id)
+        
+        for giveaway_id, message_id, guild_id in giveaways:
+            self.register(message_id, "giveaway", giveaway_id, guild_id)
+        
+        print(f"✅ 訊息路由索引已載入 (活動: {len(events)}, 抽獎: {len(giveaways)})")
+
+message_router = MessageRouter()
+
+# ========== 訊息快取 ==========
+
+MESSAGE_CACHE_SIZE = int(os.getenv("MESSAGE_CACHE_SIZE", "256"))
+
+class MessageCache:
+    """機器人訊息 LRU 快取，反應事件需要讀取 embed 時才抓取完整訊息"""
+    
+    def __init__(self, capacity=MESSAGE_CACHE_SIZE):
+        self.capacity = max(1, capacity)
+        self.messages = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def put(self, message):
+        """記錄機器人送出或編輯後的訊息（edit() 回傳的新版本）"""
+        if message is None:
+            return
+        self.messages[message.id] = message
+        self.messages.move_to_end(message.id)
+        while len(self.messages) > self.capacity:
+            self.messages.popitem(last=False)
+    
+    def discard(self, *message_ids):
+        for message_id in message_ids:
+            self.messages.pop(message_id, None)
+    
+    async def fetch(self, channel, message_id):
+        """優先使用快取，未命中才向 Discord 抓取"""
+        message = self.messages.get(message_id)
+        if message is not None:
+            self.messages.move_to_end(message_id)
+            self.hits += 1
+            return message
+        
+        self.misses += 1
+        message = await channel.fetch_message(message_id)
+        self.put(message)
+        return message
+
+message_cache = MessageCache()
+
+# ========== 訊息編輯合併 ==========
+
+EMBED_EDIT_INTERVAL = float(os.getenv("EMBED_EDIT_INTERVAL", "2"))  # 同一訊息兩次編輯的最短間隔（秒）
+
+class EmbedEditScheduler:
+    """每則訊息只保留最新的 embed，依間隔合併送出，避免反應高峰觸發頻率限制"""
+    
+    def __init__(self, interval=EMBED_EDIT_INTERVAL):
+        self.interval = interval
+        self.pending = {}       # message_id -> (message, embed)
+        self.tasks = {}         # message_id -> 送出工作
+        self.last_sent = {}     # message_id -> (embed dict, 送出時間)
+        self.requested = 0
+        self.sent = 0
+        self.skipped = 0
+    
+    def request(self, message, embed):
+        """登記訊息的最新 embed，由背景工作在間隔後送出"""
+        self.requested += 1
+        self.pending[message.id] = (message, embed)
+        if message.id not in self.tasks:
+            self.tasks[message.id] = asyncio.create_task(self._flush(message.id))
+    
+    def pending_embed(self, message_id):
+        """尚未送出的最新 embed（沒有則為 None）"""
+        entry = self.pending.get(message_id)
+        return entry[1] if entry else None
+    
+    def cancel(self, message_id):
+        """訊息即將被最終內容覆蓋時，丟棄尚未送出的編輯"""
+        self.pending.pop(message_id, None)
+        self.last_sent.pop(message_id, None)
+        task = self.tasks.pop(message_id, None)
+        if task and task is not asyncio.current_task():
+            task.cancel()
+    
+    async def _flush(self, message_id):
+        try:
+            while message_id in self.pending:
+                last = self.last_sent.get(message_id)
+                if last:
+                    delay = last[1] + self.interval - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                
+                entry = self.pending.pop(message_id, None)
+                if entry is None:
+                    break
+                message, embed = entry
+                
+                rendered = embed.to_dict()
+                if last and last[0] == rendered:
+                    self.skipped += 1
+                    continue
+                
+                try:
+                    message_cache.put(await message.edit(embed=embed))
+                    self.sent += 1
+                except Exception as e:
+                    print(f"合併編輯訊息錯誤: {e}")
+                self.last_sent[message_id] = (rendered, time.monotonic())
+        finally:
+            if self.tasks.get(message_id) is asyncio.current_task():
+                del self.tasks[message_id]
+    
+    async def stop(self):
+        """取消等待中的工作，立即送出每則訊息尚未送出的最新 embed"""
+        for task in self.tasks.values():
+            task.cancel()
+        self.tasks.clear()
+        
+        pending, self.pending = self.pending, {}
+        results = await asyncio.gather(
+            *(message.edit(embed=embed) for message, embed in pending.values()),
+            return_exceptions=True
         )
-        await conn.commit()
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"合併編輯訊息錯誤: {result}")
+            else:
+                self.sent += 1
+        print(f"✅ 訊息編輯合併統計 (請求: {self.requested}, 送出: {self.sent}, 內容相同略過: {self.skipped})")
+
+embed_editor = EmbedEditScheduler()
+
+# ========== 管理員權限快取 ==========
+
+ADMIN_CACHE_TTL = int(os.getenv("ADMIN_CACHE_TTL", "300"))
+
+class PermissionResolver:
+    """判斷反應者是否為管理員：payload.member → 成員快取 → TTL 快取 → REST 查詢"""
+    
+    def __init__(self, ttl=ADMIN_CACHE_TTL):
+        self.ttl = ttl
+        self.entries = {}  # (guild_id, user_id) -> (is_admin, expires_at)
+        self.fetches = 0
+    
+    def _store(self, guild_id, user_id, is_admin):
+        self.entries[(guild_id, user_id)] = (is_admin, time.monotonic() + self.ttl)
+        return is_admin
+    
+    async def is_admin(self, guild, user_id, member=None):
+        if member is None:
+            member = guild.get_member(user_id)
+        
+        if member is not None:
+            return self._store(guild.id, user_id, member.guild_permissions.administrator)
+        
+        cached = self.entries.get((guild.id, user_id))
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        
+        # 成員不在閘道快取時才發出 REST 請求
+        self.fetches += 1
+        member = await guild.fetch_member(user_id)
+        return self._store(guild.id, user_id, member.guild_permissions.administrator)
+    
+    def invalidate(self, guild_id, user_id=None):
+        """成員或身分組變更時清除快取；未指定用戶則清除整個伺服器"""
+        if user_id is not None:
+            self.entries.pop((guild_id, user_id), None)
+            return
+        for key in [key for key in self.entries if key[0] == guild_id]:
+            del self.entries[key]
+
+permission_resolver = PermissionResolver()
+
+# ========== 活動 / 抽獎狀態 Actor ==========
+
+SIGNUP_BATCH_WINDOW_MS = int(os.getenv("SIGNUP_BATCH_WINDOW_MS", "250"))  # 收集同一批簽到的時間窗
+SIGNUP_BATCH_SIZE = int(os.getenv("SIGNUP_BATCH_SIZE", "200"))            # 單批最多寫入筆數
+STATE_RETRY_MS = int(os.getenv("STATE_RETRY_MS", "1000"))                   # 批次寫入失敗後的重試間隔
+STATE_CLOSE_RETRIES = 3                                                     # 關閉時最多重試寫入次數
+
+class BatchStats:
+    """批次寫入統計（批次數、筆數、最大批次、平均延遲）"""
+    
+    def __init__(self):
+        self.batches = 0
+        self.rows = 0
+        self.max_size = 0
+        self.total_latency_ms = 0.0
+    
+    def record(self, size, latency_ms):
+        self.batches += 1
+        self.rows += size
+        self.max_size = max(self.max_size, size)
+        self.total_latency_ms += latency_ms
+    
+    def summary(self):
+        avg_size = self.rows / self.batches if self.batches else 0
+        avg_latency = self.total_latency_ms / self.batches if self.batches else 0
+        return f"批次: {self.batches}, 筆數: {self.rows}, 平均批次: {avg_size:.1f}, 最大批次: {self.max_size}, 平均延遲: {avg_latency:.0f}ms"
+
+signup_batch_stats = BatchStats()
+
+def utc_timestamp(moment=None):
+    """與 SQLite CURRENT_TIMESTAMP 相同格式的 UTC 時間（moment 未帶時區時視為本地時間）"""
+    moment = moment or datetime.now(timezone.utc)
+    return moment.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+class StateActor:
+    """單一活動或抽獎的狀態擁有者：變更依佇列順序逐一處理，並在時間窗內收集成批寫入資料庫"""
+    
+    def __init__(self, batch_window_ms=SIGNUP_BATCH_WINDOW_MS, batch_size=SIGNUP_BATCH_SIZE):
+        self.queue = asyncio.Queue()
+        self.task = None
+        self.loaded = False
+        self.batch_window = batch_window_ms / 1000
+        self.batch_size = batch_size
+        self.retry_delay = STATE_RETRY_MS / 1000
+        self.batch_started = None
+        self.predecessor = None  # 同一活動前一個 actor 的關閉工作，載入前需等它寫完
+    
+    async def call(self, handler, *args):
+        """將變更排入佇列並等待結果，同一 actor 的變更不會交錯執行"""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((handler, args, future))
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+        return await future
+    
+    async def _run(self):
+        while True:
+            if self.loaded and self.pending_writes():
+                # 上一批寫入失敗：等待新變更一起寫入，或在重試間隔後單獨重試
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), self.retry_delay)
+                except asyncio.TimeoutError:
+                    await self._persist_safely()
+                    continue
+            else:
+                item = await self.queue.get()
+            self.batch_started = time.perf_counter()
+            
+            # 持續處理到時間窗結束或批次已滿；沒有待寫入資料時不必等待
+            while True:
+                await self._process(*item)
+                
+                pending = self.pending_writes() if self.loaded else 0
+                if pending >= self.batch_size or (pending == 0 and self.queue.empty()):
+                    break
+                
+                if not self.queue.empty():
+                    item = self.queue.get_nowait()
+                    continue
+                
+                remaining = self.batch_window - (time.perf_counter() - self.batch_started)
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            
+            await self._persist_safely()
+    
+    async def _process(self, handler, args, future):
+        try:
+            if not self.loaded:
+                if self.predecessor is not None:
+                    await asyncio.wait({self.predecessor})
+                    self.predecessor = None
+                await self.load()
+                self.loaded = True
+            result = await handler(*args)
+            if not future.done():
+                future.set_result(result)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+    
+    async def _persist_safely(self):
+        if not self.loaded:
+            return
+        try:
+            await self.persist()
+        except Exception as e:
+            # 已回覆給呼叫者的變更保留在記憶體，下一批重新寫入（INSERT OR IGNORE 可安全重送）
+            print(f"狀態寫入錯誤（{self.pending_writes()} 筆待重試）: {e}")
+    
+    async def close(self):
+        """處理完佇列中的變更並寫入資料庫後停止"""
+        if self.predecessor is not None:
+            await asyncio.wait({self.predecessor})
+        if self.task is None:
+            return
+        for attempt in range(STATE_CLOSE_RETRIES):
+            await self.call(self._persist_safely)
+            if not self.loaded or not self.pending_writes():
+                break
+            await asyncio.sleep(self.retry_delay)
+        else:
+            print(f"⚠️ 狀態寫入失敗，關閉時放棄 {self.pending_writes()} 筆變更")
+        self.task.cancel()
+        self.task = None
+    
+    def pending_writes(self):
+        """尚未寫入資料庫的變更數"""
+        return 0
+    
+    async def load(self):
+        raise NotImplementedError
+    
+    async def persist(self):
+        raise NotImplementedError
+
+class EventActor(StateActor):
+    """評核活動：簽到名單與職業選擇"""
+    
+    def __init__(self, event_id, guild_id):
+        super().__init__()
+        self.event_id = event_id
+        self.guild_id = guild_id
+        self.signup_message = None
+    
+    async def load(self):
+        async with db_pool.reader() as conn:
+            async with conn.execute("SELECT user_id FROM event_participants WHERE event_id = ?", (self.event_id,)) as cursor:
+                self.participants = {row[0] for row in await cursor.fetchall()}
+            async with conn.execute("SELECT professions FROM evaluation_events WHERE id = ?", (self.event_id,)) as cursor:
+                result = await cursor.fetchone()
+        self.professions = json.loads(result[0]) if result and result[0] else {}
+        self.new_signups = []
+        self.professions_dirty = False
+    
+    def pending_writes(self):
+        return len(self.new_signups) + (1 if self.professions_dirty else 0)
+    
+    async def _signup(self, user_id):
+        if user_id in self.participants:
+            return False, len(self.participants)
+        self.participants.add(user_id)
+        self.new_signups.append((self.event_id, user_id, utc_timestamp()))
+        return True, len(self.participants)
+    
+    async def signup(self, user_id, message=None):
+        """簽到，回傳 (是否為新簽到, 目前簽到人數)；人數顯示在批次寫入後統一更新"""
+        if message is not None:
+            self.signup_message = message
+        return await self.call(self._signup, user_id)
+    
+    async def _pick_profession(self, user_id, profession_name):
+        if user_id not in self.participants:
+            return "not_signed"
+        if str(user_id) in self.professions:
+            return "duplicate"
+        self.professions[str(user_id)] = profession_name
+        self.professions_dirty = True
+        return "added"
+    
+    async def pick_profession(self, user_id, profession_name):
+        """選擇職業，回傳 added / duplicate / not_signed"""
+        return await self.call(self._pick_profession, user_id, profession_name)
+    
+    async def persist(self):
+        if not self.new_signups and not self.professions_dirty:
+            return
+        
+        signup_count = len(self.new_signups)
+        
+        async with db_pool.writer() as conn:
+            if self.new_signups:
+                await conn.executemany(
+                    "INSERT OR IGNORE INTO event_participants (event_id, user_id, signed_at) VALUES (?, ?, ?)",
+                    self.new_signups
+                )
+            if self.professions_dirty:
+                await conn.execute("UPDATE evaluation_events SET professions = ? WHERE id = ?",
+                                   (json.dumps(self.professions), self.event_id))
+            await conn.commit()
+        
+        self.new_signups = []
+        self.professions_dirty = False
+        
+        if signup_count:
+            latency_ms = (time.perf_counter() - self.batch_started) * 1000
+            signup_batch_stats.record(signup_count, latency_ms)
+            print(f"📦 簽到批次寫入: 活動 {self.event_id}, {signup_count} 筆, 延遲 {latency_ms:.0f}ms")
+            
+            # 每批只更新一次人數顯示
+            if self.signup_message is not None:
+                await refresh_signup_counter(self.signup_message, len(self.participants))
+
+class GiveawayActor(StateActor):
+    """抽獎：參與者名單與人數"""
+    
+    def __init__(self, giveaway_id):
+        super().__init__()
+        self.giveaway_id = giveaway_id
+    
+    def pending_writes(self):
+        return len(self.new_entries)
+    
+    async def load(self):
+        async with db_pool.reader() as conn:
+            async with conn.execute("SELECT user_id FROM giveaway_entries WHERE giveaway_id = ?", (self.giveaway_id,)) as cursor:
+                self.entries = {row[0] for row in await cursor.fetchall()}
+        self.new_entries = []
+    
+    async def _enter(self, user_id):
+        if user_id in self.entries:
+            return False, len(self.entries)
+        self.entries.add(user_id)
+        self.new_entries.append((self.giveaway_id, user_id, utc_timestamp()))
+        return True, len(self.entries)
+    
+    async def enter(self, user_id):
+        """參加抽獎，回傳 (是否為新參與, 目前參與人數)"""
+        return await self.call(self._enter, user_id)
+    
+    async def persist(self):
+        if not self.new_entries:
+            return
+        
+        async with db_pool.writer() as conn:
+            cursor = await conn.executemany(
+                "INSERT OR IGNORE INTO giveaway_entries (giveaway_id, user_id, entered_at) VALUES (?, ?, ?)",
+                self.new_entries
+            )
+            # 只累加實際新增的筆數（重送的批次已存在的列不計入）
+            await conn.execute("UPDATE giveaways SET entry_count = entry_count + ? WHERE id = ?",
+                               (cursor.rowcount, self.giveaway_id))
+            await conn.commit()
+        
+        self.new_entries = []
+
+class StateActorRegistry:
+    """依活動 / 抽獎建立 actor，不同活動之間互不阻塞"""
+    
+    def __init__(self):
+        self.actors = {}
+        self.closing = {}  # (類型, ID) -> 關閉中 actor 的寫入工作
+    
+    def _get(self, key, factory):
+        actor = self.actors.get(key)
+        if actor is None:
+            actor = self.actors[key] = factory()
+            # 舊 actor 尚未寫完時，新 actor 等它寫完再從資料庫載入
+            actor.predecessor = self.closing.get(key)
+        return actor
+    
+    def event(self, event_id, guild_id=0):
+        return self._get(("event", event_id), lambda: EventActor(event_id, guild_id))
+    
+    def giveaway(self, giveaway_id):
+        return self._get(("giveaway", giveaway_id), lambda: GiveawayActor(giveaway_id))
+    
+    async def close(self, kind, target_id):
+        """寫入並移除 actor；之後再使用會等寫入完成後從資料庫重新載入"""
+        key = (kind, target_id)
+        actor = self.actors.pop(key, None)
+        if actor:
+            closing = asyncio.create_task(actor.close())
+            self.closing[key] = closing
+            try:
+                await closing
+            finally:
+                if self.closing.get(key) is closing:
+                    del self.closing[key]
+    
+    async def close_all(self):
+        for kind, target_id in list(self.actors):
+            await self.close(kind, target_id)
+        print(f"✅ 簽到批次統計 ({signup_batch_stats.summary()})")
+
+state_actors = StateActorRegistry()
+
+# ========== 計時排程 ==========
+
+class TimerScheduler:
+    """所有倒數共用的單一排程器：以絕對時間排序的 heap，只在最近的期限到時喚醒"""
+    
+    def __init__(self):
+        self.heap = []          # (deadline, seq, key)
+        self.timers = {}        # key -> (seq, callback)
+        self.seq = 0
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.running = set()    # 執行中的回呼，保留參照避免被回收
+    
+    def schedule(self, deadline, key, callback):
+        """在 deadline（time.time() 時間戳）執行 callback；同一 key 重新排程會取代舊的計時器"""
+        self.seq += 1
+        self.timers[key] = (self.seq, callback)
+        heapq.heappush(self.heap, (deadline, self.seq, key))
+        if self.heap[0][1] == self.seq:
+            self.wakeup.set()
+    
+    def cancel(self, *keys):
+        # heap 中的舊項目在到期時會因 seq 不符而略過
+        for key in keys:
+            self.timers.pop(key, None)
+    
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+    
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+    
+    async def _run(self):
+        while True:
+            now = time.time()
+            while self.heap and self.heap[0][0] <= now:
+                _, seq, key = heapq.heappop(self.heap)
+                timer = self.timers.get(key)
+                if timer is None or timer[0] != seq:
+                    continue
+                del self.timers[key]
+                task = asyncio.create_task(self._fire(key, timer[1]))
+                self.running.add(task)
+                task.add_done_callback(self.running.discard)
+            
+            self.wakeup.clear()
+            timeout = self.heap[0][0] - now if self.heap else None
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+    
+    async def _fire(self, key, callback):
+        try:
+            await callback()
+        except Exception as e:
+            print(f"計時器 {key} 執行錯誤: {e}")
+
+timer_scheduler = TimerScheduler()
+
+# ========== 積分排行榜 ==========
+
+class ScoreLeaderboard:
+    """各伺服器的積分排名：以 (-當前積分, 用戶ID) 排序的陣列，二分搜尋取得名次，由積分寫入路徑即時更新"""
+    
+    def __init__(self):
+        self.keys = {}   # guild_id -> 已排序的 (-current_score, user_id)
+        self.users = {}  # guild_id -> {user_id: (username, current_score, total_score)}
+        self.totals = {} # guild_id -> [當前積分總和, 總積分總和]
+    
+    async def load(self):
+        """啟動時從資料庫載入所有用戶積分"""
+        self.keys.clear()
+        self.users.clear()
+        self.totals.clear()
+        
+        async with db_pool.reader() as conn:
+            async with conn.execute("SELECT guild_id, user_id, username, current_score, total_score FROM users") as cursor:
+                rows = await cursor.fetchall()
+        
+        for guild_id, user_id, username, current_score, total_score in rows:
+            self.users.setdefault(guild_id, {})[user_id] = (username, current_score or 0, total_score or 0)
+            totals = self.totals.setdefault(guild_id, [0, 0])
+            totals[0] += current_score or 0
+            totals[1] += total_score or 0
+        
+        for guild_id, users in self.users.items():
+            self.keys[guild_id] = sorted((-data[1], user_id) for user_id, data in users.items())
+        
+        print(f"✅ 積分排行榜已載入 (伺服器: {len(self.users)}, 用戶: {len(rows)})")
+    
+    def update(self, guild_id, user_id, current_score, total_score, username=None):
+        """資料庫提交後同步單一用戶的積分"""
+        keys = self.keys.setdefault(guild_id, [])
+        users = self.users.setdefault(guild_id, {})
+        totals = self.totals.setdefault(guild_id, [0, 0])
+        
+        old = users.get(user_id)
+        if old:
+            index = bisect.bisect_left(keys, (-old[1], user_id))
+            if index < len(keys) and keys[index] == (-old[1], user_id):
+                del keys[index]
+            username = old[0]  # 資料庫中的名稱只在建立用戶時寫入
+            totals[0] -= old[1]
+            totals[1] -= old[2]
+        
+        users[user_id] = (username or f"用戶{user_id}", current_score, total_score)
+        bisect.insort(keys, (-current_score, user_id))
+        totals[0] += current_score
+        totals[1] += total_score
+    
+    def apply_balances(self, guild_id, balances, usernames=None):
+        """套用 {用戶ID: (當前積分, 總積分)}"""
+        for user_id, (current_score, total_score) in balances.items():
+            self.update(guild_id, user_id, current_score, total_score, (usernames or {}).get(user_id))
+    
+    def top(self, guild_id, limit):
+        """前 N 名 [(用戶ID, 用戶名稱, 當前積分, 總積分)]"""
+        users = self.users.get(guild_id, {})
+        return [(user_id, *users[user_id]) for _, user_id in self.keys.get(guild_id, [])[:limit]]
+    
+    def rank(self, guild_id, user_id):
+        """名次 = 積分高於此用戶的人數 + 1（沒有紀錄的用戶視為 0 分）"""
+        data = self.users.get(guild_id, {}).get(user_id)
+        current_score = data[1] if data else 0
+        return bisect.bisect_left(self.keys.get(guild_id, []), (-current_score,)) + 1
+    
+    def summary(self, guild_id):
+        """(用戶數, 當前積分總和, 總積分總和)"""
+        current_total, earned_total = self.totals.get(guild_id, (0, 0))
+        return len(self.users.get(guild_id, {})), current_total, earned_total
+
+score_board = ScoreLeaderboard()
 
 # ========== 通用函數 ==========
 
 async def get_user_score(user_id, guild_id=0):
     """取得用戶積分"""
-    async with aiosqlite.connect(DB_NAME) as conn:
+    async with db_pool.reader() as conn:
         async with conn.execute("SELECT current_score, total_score FROM users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
             result = await cursor.fetchone()
             
@@ -212,84 +1354,115 @@ async def get_user_score(user_id, guild_id=0):
                 return result[0], result[1]
             return 0, 0
 
+async def write_score_entry(conn, user_id, username, amount, reason="", guild_id=0):
+    """在呼叫者的交易中寫入一筆積分變動與帳本紀錄，回傳 (當前積分, 總積分)"""
+    # 新用戶：積分不低於 0；既有用戶：當前積分直接加減，總積分只累加正數
+    async with conn.execute("""
+        INSERT INTO users (user_id, username, current_score, total_score, guild_id)
+        VALUES (?, ?, MAX(?, 0), MAX(?, 0), ?)
+        ON CONFLICT(user_id, guild_id) DO UPDATE SET 
+            current_score = current_score + ?,
+            total_score = total_score + MAX(?, 0),
+            last_active = CURRENT_TIMESTAMP
+        RETURNING current_score, total_score
+    """, (user_id, username, amount, amount, guild_id, amount, amount)) as cursor:
+        current_score, total_score = await cursor.fetchone()
+    
+    # 記錄積分變動
+    if amount != 0:
+        from_user_id = user_id if amount < 0 else None
+        to_user_id = user_id if amount > 0 else None
+        reason_text = reason if reason else ("系統扣除" if amount < 0 else "系統增加")
+        await conn.execute(
+            "INSERT INTO score_transfers (from_user_id, to_user_id, amount, reason, guild_id) VALUES (?, ?, ?, ?, ?)",
+            (from_user_id, to_user_id, abs(amount), reason_text, guild_id)
+        )
+    
+    return current_score, total_score
+
+async def apply_score_changes(entries, guild_id=0):
+    """在單一交易中套用多筆 (用戶ID, 用戶名稱, 積分變動, 原因)，回傳 {用戶ID: (當前積分, 總積分)}"""
+    balances = {}
+    async with db_pool.writer() as conn:
+        for user_id, username, amount, reason in entries:
+            balances[user_id] = await write_score_entry(conn, user_id, username, amount, reason, guild_id)
+        await conn.commit()
+    
+    score_board.apply_balances(guild_id, balances, {user_id: username for user_id, username, _, _ in entries})
+    return balances
+
 async def update_user_score(user_id, username, amount, reason="", guild_id=0):
-    """更新用戶積分"""
+    """更新用戶積分，回傳 (當前積分, 總積分)"""
     try:
-        async with aiosqlite.connect(DB_NAME) as conn:
-            # 先檢查用戶是否已存在
-            async with conn.execute("SELECT user_id FROM users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
-                existing_user = await cursor.fetchone()
-            
-            if not existing_user:
-                # 用戶不存在，插入新用戶
-                current_score = max(amount, 0)
-                total_score = max(amount, 0)
-                await conn.execute(
-                    "INSERT OR IGNORE INTO users (user_id, username, current_score, total_score, guild_id) VALUES (?, ?, ?, ?, ?)",
-                    (user_id, username, current_score, total_score, guild_id)
-                )
-            else:
-                # 用戶存在，更新積分
-                if amount > 0:
-                    await conn.execute(
-                        "UPDATE users SET current_score = current_score + ?, total_score = total_score + ?, last_active = CURRENT_TIMESTAMP WHERE user_id = ? AND guild_id = ?",
-                        (amount, amount, user_id, guild_id)
-                    )
-                else:
-                    await conn.execute(
-                        "UPDATE users SET current_score = current_score + ?, last_active = CURRENT_TIMESTAMP WHERE user_id = ? AND guild_id = ?",
-                        (amount, user_id, guild_id)
-                    )
-            
-            # 記錄積分變動
-            if amount != 0:
-                from_user_id = user_id if amount < 0 else None
-                to_user_id = user_id if amount > 0 else None
-                reason_text = reason if reason else ("系統扣除" if amount < 0 else "系統增加")
-                await conn.execute(
-                    "INSERT INTO score_transfers (from_user_id, to_user_id, amount, reason, guild_id) VALUES (?, ?, ?, ?, ?)",
-                    (from_user_id, to_user_id, abs(amount), reason_text, guild_id)
-                )
-            
-            await conn.commit()
-            
+        balances = await apply_score_changes([(user_id, username, amount, reason)], guild_id)
+        return balances[user_id]
     except Exception as e:
         print(f"更新用戶積分錯誤: {e}")
+        return None
+
+async def transfer_user_score(from_user, to_user, amount, reason, guild_id=0):
+    """在單一交易中轉移積分，回傳 (是否成功, 轉出者積分)"""
+    async with db_pool.writer() as conn:
+        async with conn.execute("SELECT current_score FROM users WHERE user_id = ? AND guild_id = ?", (from_user.id, guild_id)) as cursor:
+            result = await cursor.fetchone()
+        
+        sender_score = result[0] if result else 0
+        if sender_score < amount:
+            return False, sender_score
+        
+        sender_balance = await write_score_entry(conn, from_user.id, from_user.name, -amount, f"轉移給 {to_user.name}", guild_id)
+        receiver_balance = await write_score_entry(conn, to_user.id, to_user.name, amount, f"來自 {from_user.name} 的轉移", guild_id)
+        await conn.execute('''
+            INSERT INTO score_transfers (from_user_id, to_user_id, amount, reason, guild_id)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (from_user.id, to_user.id, amount, reason or "無", guild_id))
+        
+        await conn.commit()
+    
+    score_board.update(guild_id, from_user.id, *sender_balance, from_user.name)
+    score_board.update(guild_id, to_user.id, *receiver_balance, to_user.name)
+    return True, sender_balance[0]
 
 async def get_user_profile(user_id, guild_id=0):
     """獲取用戶完整資料"""
-    async with aiosqlite.connect(DB_NAME) as conn:
-        async with conn.execute("SELECT current_score, total_score, join_date, profession_counts, activity_stats, rating_stats FROM users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
+    async with db_pool.reader() as conn:
+        async with conn.execute("SELECT current_score, total_score, join_date, profession_counts, rating_stats FROM users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
             result = await cursor.fetchone()
+        
+        async with conn.execute("SELECT period_id, total, attended FROM attendance WHERE guild_id = ? AND user_id = ?", (guild_id, user_id)) as cursor:
+            attendance_rows = await cursor.fetchall()
+
+        if result:
+            current_score, total_score, join_date, profession_str, rating_str = result
             
-            if result:
-                current_score, total_score, join_date, profession_str, activity_str, rating_str = result
-                
-                try:
-                    join_date_str = datetime.strptime(join_date.split('.')[0], '%Y-%m-%d %H:%M:%S').strftime('%Y-%m-%d')
-                except:
-                    join_date_str = join_date
-                
-                profession_counts = json.loads(profession_str) if profession_str else {}
-                activity_stats = json.loads(activity_str) if activity_str else {}
-                rating_stats = json.loads(rating_str) if rating_str else {}
-                
-                return {
-                    'user_id': user_id,
-                    'current_score': current_score,
-                    'total_score': total_score,
-                    'join_date': join_date_str,
-                    'profession_counts': profession_counts,
-                    'activity_stats': activity_stats,
-                    'rating_stats': rating_stats
-                }
+            try:
+                join_date_str = datetime.strptime(join_date.split('.')[0], '%Y-%m-%d %H:%M:%S').strftime('%Y-%m-%d')
+            except:
+                join_date_str = join_date
+            
+            profession_counts = json.loads(profession_str) if profession_str else {}
+            activity_stats = {
+                period_id: {"total": total, "attended": attended}
+                for period_id, total, attended in attendance_rows
+            }
+            rating_stats = json.loads(rating_str) if rating_str else {}
             
-            return None
+            return {
+                'user_id': user_id,
+                'current_score': current_score,
+                'total_score': total_score,
+                'join_date': join_date_str,
+                'profession_counts': profession_counts,
+                'activity_stats': activity_stats,
+                'rating_stats': rating_stats
+            }
+        
+        return None
 
 async def update_user_profession(user_id, profession, guild_id=0):
     """更新用戶職業統計"""
     try:
-        async with aiosqlite.connect(DB_NAME) as conn:
+        async with db_pool.writer() as conn:
             async with conn.execute("SELECT profession_counts, username FROM users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
                 result = await cursor.fetchone()
             
@@ -315,42 +1488,10 @@ async def update_user_profession(user_id, profession, guild_id=0):
     except Exception as e:
         print(f"更新職業統計錯誤: {e}")
 
-async def update_user_activity(user_id, event_name, attended=True, guild_id=0):
-    """更新用戶活動統計"""
-    try:
-        async with aiosqlite.connect(DB_NAME) as conn:
-            async with conn.execute("SELECT activity_stats FROM users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
-                result = await cursor.fetchone()
-            
-            if result:
-                activity_str = result[0]
-                activity_stats = json.loads(activity_str) if activity_str else {}
-                
-                # 獲取當前半月期
-                now = datetime.now()
-                year_month = now.strftime("%Y-%m")
-                day = now.day
-                current_period = f"{year_month}-上半" if day <= 15 else f"{year_month}-下半"
-                
-                if current_period not in activity_stats:
-                    activity_stats[current_period] = {"total": 0, "attended": 0}
-                
-                activity_stats[current_period]["total"] += 1
-                if attended:
-                    activity_stats[current_period]["attended"] += 1
-                
-                await conn.execute("UPDATE users SET activity_stats = ? WHERE user_id = ? AND guild_id = ?", 
-                                  (json.dumps(activity_stats), user_id, guild_id))
-                
-                await conn.commit()
-                
-    except Exception as e:
-        print(f"更新活動統計錯誤: {e}")
-
 async def update_user_rating(user_id, rating_type, guild_id=0):
     """更新用戶評核統計"""
     try:
-        async with aiosqlite.connect(DB_NAME) as conn:
+        async with db_pool.writer() as conn:
             async with conn.execute("SELECT rating_stats FROM users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
                 result = await cursor.fetchone()
             
@@ -364,9 +1505,10 @@ async def update_user_rating(user_id, rating_type, guild_id=0):
                     rating_stats[rating_type] = 1
                 
                 score = RATING_SCORES.get(rating_type, 0)
+                balance = None
                 
                 if score != 0:
-                    await conn.execute("""
+                    async with conn.execute("""
                         UPDATE users 
                         SET current_score = current_score + ?, 
                             total_score = CASE 
@@ -374,15 +1516,254 @@ async def update_user_rating(user_id, rating_type, guild_id=0):
                                             ELSE 0
                                           END
                         WHERE user_id = ? AND guild_id = ?
-                    """, (score, score, score, user_id, guild_id))
+                        RETURNING current_score, total_score
+                    """, (score, score, score, user_id, guild_id)) as cursor:
+                        balance = await cursor.fetchone()
                 
                 await conn.execute("UPDATE users SET rating_stats = ? WHERE user_id = ? AND guild_id = ?", 
                                   (json.dumps(rating_stats), user_id, guild_id))
                 
                 await conn.commit()
                 
+                if balance:
+                    score_board.update(guild_id, user_id, *balance)
+                
+    except Exception as e:
+        print(f"更新評核統計錯誤: {e}")
+
+async def get_event_participants(event_id):
+    """取得活動參與者列表（依簽到順序）"""
+    async with db_pool.reader() as conn:
+        async with conn.execute(
+            "SELECT user_id FROM event_participants WHERE event_id = ? ORDER BY signed_at, rowid",
+            (event_id,)
+        ) as cursor:
+            return [row[0] for row in await cursor.fetchall()]
+
+async def settle_event_signups(event_id, event_name, guild_id=0):
+    """簽到結束時在單一交易中為所有參與者發放簽到積分、記錄出席並給予預設評級
+    
+    結算標記與結算寫入同一交易；已結算的活動只回傳參與者（耗時為 None），不會重複發放
+    """
+    start = time.perf_counter()
+    default_rating = "普通"
+    rating_score = RATING_SCORES.get(default_rating, 0)
+    current_period = get_current_half_month()
+    balances = {}  # 用戶ID -> 交易內最終的 (當前積分, 總積分)
+    
+    async with db_pool.writer() as conn:
+        async with conn.execute(
+            "UPDATE evaluation_events SET signup_settled_at = CURRENT_TIMESTAMP WHERE id = ? AND signup_settled_at IS NULL",
+            (event_id,)
+        ) as cursor:
+            claimed = cursor.rowcount == 1
+        
+        async with conn.execute(
+            "SELECT user_id FROM event_participants WHERE event_id = ? ORDER BY signed_at, rowid",
+            (event_id,)
+        ) as cursor:
+            participants = [row[0] for row in await cursor.fetchall()]
+        
+        if not claimed:
+            await conn.rollback()
+            print(f"⏭️ 簽到已結算過，略過發放: {event_name}")
+            return participants, None
+        
+        if participants:
+            # 簽到積分（新用戶以預設名稱建立）
+            async with conn.execute("""
+                INSERT INTO users (user_id, username, current_score, total_score, guild_id)
+                SELECT user_id, '用戶' || user_id, MAX(?, 0), MAX(?, 0), ?
+                FROM event_participants 
+                WHERE event_id = ?
+                ON CONFLICT(user_id, guild_id) DO UPDATE SET 
+                    current_score = current_score + ?,
+                    total_score = total_score + MAX(?, 0),
+                    last_active = CURRENT_TIMESTAMP
+                RETURNING user_id, current_score, total_score
+            """, (SIGNUP_SCORE, SIGNUP_SCORE, guild_id, event_id, SIGNUP_SCORE, SIGNUP_SCORE)) as cursor:
+                balances.update((user_id, (current, total)) for user_id, current, total in await cursor.fetchall())
+            
+            if SIGNUP_SCORE != 0:
+                await conn.execute("""
+                    INSERT INTO score_transfers (from_user_id, to_user_id, amount, reason, guild_id)
+                    SELECT CASE WHEN ? < 0 THEN user_id END, CASE WHEN ? > 0 THEN user_id END, ?, ?, ?
+                    FROM event_participants 
+                    WHERE event_id = ?
+                """, (SIGNUP_SCORE, SIGNUP_SCORE, abs(SIGNUP_SCORE), f"活動簽到: {event_name}", guild_id, event_id))
+            
+            # 出席統計
+            await conn.execute("""
+                INSERT INTO attendance (guild_id, user_id, period_id, total, attended)
+                SELECT ?, user_id, ?, 1, 1
+                FROM event_participants 
+                WHERE event_id = ?
+                ON CONFLICT(guild_id, user_id, period_id) DO UPDATE SET 
+                    total = total + 1,
+                    attended = attended + 1
+            """, (guild_id, current_period, event_id))
+            
+            # 出席排名表（當前半月期與全部期間）
+            await conn.execute("""
+                INSERT INTO attendance_ranking (guild_id, period_id, user_id, username, attended)
+                SELECT ?, periods.period_id, u.user_id, u.username, 1
+                FROM event_participants p
+                JOIN users u ON u.guild_id = ? AND u.user_id = p.user_id
+                CROSS JOIN (SELECT ? AS period_id UNION ALL SELECT 'all') periods
+                WHERE p.event_id = ?
+                ON CONFLICT(guild_id, period_id, user_id) DO UPDATE SET attended = attended + 1
+            """, (guild_id, guild_id, current_period, event_id))
+            
+            # 預設評級（rating_stats 為 JSON，一次讀出後以 executemany 寫回）
+            async with conn.execute("""
+                SELECT user_id, rating_stats FROM users 
+                WHERE guild_id = ? AND user_id IN (SELECT user_id FROM event_participants WHERE event_id = ?)
+            """, (guild_id, event_id)) as cursor:
+                rating_rows = await cursor.fetchall()
+            
+            updates = []
+            for user_id, rating_str in rating_rows:
+                rating_stats = json.loads(rating_str) if rating_str else {}
+                rating_stats[default_rating] = rating_stats.get(default_rating, 0) + 1
+                updates.append((json.dumps(rating_stats), user_id, guild_id))
+            
+            await conn.executemany("UPDATE users SET rating_stats = ? WHERE user_id = ? AND guild_id = ?", updates)
+            
+            if rating_score != 0:
+                async with conn.execute("""
+                    UPDATE users 
+                    SET current_score = current_score + ?, 
+                        total_score = CASE 
+                                        WHEN total_score + ? > 0 THEN total_score + ?
+                                        ELSE 0
+                                      END
+                    WHERE guild_id = ? AND user_id IN (SELECT user_id FROM event_participants WHERE event_id = ?)
+                    RETURNING user_id, current_score, total_score
+                """, (rating_score, rating_score, rating_score, guild_id, event_id)) as cursor:
+                    balances.update((user_id, (current, total)) for user_id, current, total in await cursor.fetchall())
+        
+        # 本期活動數 +1（無人簽到的活動同樣計入）
+        await conn.execute("""
+            INSERT INTO period_events (guild_id, period_id, event_count) VALUES (?, ?, 1)
+            ON CONFLICT(guild_id, period_id) DO UPDATE SET event_count = event_count + 1
+        """, (guild_id, current_period))
+        
+        await conn.execute("UPDATE evaluation_events SET default_rated = ?, is_active = 1 WHERE id = ?", 
+                         (json.dumps(participants), event_id))
+        await conn.commit()
+        
+        # 在釋放寫入連線前套用交易內的積分，之後提交的寫入不會被舊值覆蓋
+        score_board.apply_balances(guild_id, balances)
+    
+    attendance_cache.invalidate(guild_id)
+    
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print(f"✅ 簽到結算完成: {event_name}, 參與者: {len(participants)}人, 耗時: {elapsed_ms:.1f}ms")
+    return participants, elapsed_ms
+
+async def get_giveaway_entries(giveaway_id):
+    """取得抽獎參與者列表"""
+    async with db_pool.reader() as conn:
+        async with conn.execute(
+            "SELECT user_id FROM giveaway_entries WHERE giveaway_id = ? ORDER BY entered_at, rowid",
+            (giveaway_id,)
+        ) as cursor:
+            return [row[0] for row in await cursor.fetchall()]
+
+async def record_evaluation_rating(event_id, user_id, rater_id, rating_type):
+    """記錄一筆評核，回傳此前的最新評級"""
+    async with db_pool.writer() as conn:
+        async with conn.execute("""
+            SELECT rating FROM evaluation_ratings 
+            WHERE event_id = ? AND user_id = ? 
+            ORDER BY rated_at DESC, id DESC 
+            LIMIT 1
+        """, (event_id, user_id)) as cursor:
+            result = await cursor.fetchone()
+        
+        await conn.execute(
+            "INSERT INTO evaluation_ratings (event_id, user_id, rater_id, rating, rated_at) VALUES (?, ?, ?, ?, ?)",
+            (event_id, user_id, rater_id, rating_type, utc_timestamp())
+        )
+        await conn.commit()
+        
+        return result[0] if result else None
+
+async def get_rating_distribution(event_id):
+    """取得活動中每位用戶最新評級的分佈"""
+    async with db_pool.reader() as conn:
+        async with conn.execute("""
+            SELECT rating, COUNT(*) 
+            FROM (
+                SELECT rating, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY rated_at DESC, id DESC) AS rn
+                FROM evaluation_ratings 
+                WHERE event_id = ?
+            ) 
+            WHERE rn = 1 
+            GROUP BY rating
+        """, (event_id,)) as cursor:
+            return {rating: count for rating, count in await cursor.fetchall()}
+
+def discord_timestamp(epoch, style="R"):
+    """Discord 時間戳標記，客戶端會自行顯示相對時間"""
+    return f"<t:{int(epoch)}:{style}>"
+
+def chunk_text(items, limit, separator="\n", max_items=None):
+    """將字串依序合併為不超過 limit 字元（及 max_items 項）的區塊"""
+    chunks = []
+    current = []
+    length = 0
+    
+    for item in items:
+        extra = len(item) + (len(separator) if current else 0)
+        if current and (length + extra > limit or (max_items and len(current) >= max_items)):
+            chunks.append(separator.join(current))
+            current = []
+            length = 0
+            extra = len(item)
+        current.append(item)
+        length += extra
+    
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
+
+def rebuild_embed(embed, overrides):
+    """複製 embed，並以 overrides（欄位名稱 → 新值）取代指定欄位"""
+    new_embed = discord.Embed(
+        title=embed.title,
+        description=embed.description,
+        color=embed.color
+    )
+    
+    for field in embed.fields:
+        new_embed.add_field(
+            name=field.name, 
+            value=overrides.get(field.name, field.value), 
+            inline=field.inline
+        )
+    
+    if embed.footer:
+        new_embed.set_footer(text=embed.footer.text)
+    
+    return new_embed
+
+async def current_embed(message):
+    """訊息目前的 embed：優先使用排隊中的最新版本，其次為快取或抓取的訊息"""
+    embed = embed_editor.pending_embed(message.id)
+    if embed is None:
+        full_message = await message_cache.fetch(message.channel, message.id)
+        embed = full_message.embeds[0] if full_message.embeds else None
+    return embed
+
+async def refresh_signup_counter(message, participants_count):
+    """更新簽到訊息的「已簽到」人數（經由合併編輯送出）"""
+    try:
+        embed = await current_embed(message)
+        if embed is not None:
+            embed_editor.request(message, rebuild_embed(embed, {"👥 已簽到": f"{participants_count} 人"}))
     except Exception as e:
-        print(f"更新評核統計錯誤: {e}")
+        print(f"更新簽到訊息錯誤: {e}")
 
 def get_current_half_month():
     """獲取當前半月期"""
@@ -397,28 +1778,15 @@ def get_current_half_month():
 
 async def get_total_events_in_period(guild_id=0, period: str = "current"):
     """獲取指定期間內的總活動數"""
-    async with aiosqlite.connect(DB_NAME) as conn:
+    async with db_pool.reader() as conn:
         if period == "current":
-            # 計算當前半月期內的總活動數
-            current_period = get_current_half_month()
-            
-            # 獲取所有用戶的活動統計
-            async with conn.execute("SELECT activity_stats FROM users WHERE guild_id = ?", (guild_id,)) as cursor:
-                results = await cursor.fetchall()
-            
-            total_events_in_period = 0
-            
-            for activity_str, in results:
-                if not activity_str:
-                    continue
-                    
-                activity_stats = json.loads(activity_str)
-                if current_period in activity_stats:
-                    user_total = activity_stats[current_period].get("total", 0)
-                    if user_total > total_events_in_period:
-                        total_events_in_period = user_total
-            
-            return total_events_in_period
+            # 當前半月期的活動數由 period_events 計數表直接取得
+            async with conn.execute(
+                "SELECT event_count FROM period_events WHERE guild_id = ? AND period_id = ?",
+                (guild_id, get_current_half_month())
+            ) as cursor:
+                result = await cursor.fetchone()
+                return result[0] if result else 0
             
         else:  # all
             # 計算所有活動的總數
@@ -428,133 +1796,346 @@ async def get_total_events_in_period(guild_id=0, period: str = "current"):
             
             return total_events
 
-async def get_all_attendance_data(guild_id=0, period: str = "current"):
-    """獲取所有用戶的出席數據"""
+ATTENDANCE_PAGE_SIZE = 100  # 出席排行榜每頁人數
+
+# 無出席紀錄的用戶：沿 users(guild_id, username, user_id) 索引讀取
+NO_ATTENDANCE_FILTER = """
+    NOT EXISTS (
+        SELECT 1 FROM attendance_ranking r 
+        WHERE r.guild_id = u.guild_id AND r.period_id = ? AND r.user_id = u.user_id AND r.attended > 0
+    )
+"""
+
+def attendance_period_id(period):
+    """出席排名表的期間ID：當前半月期或 all"""
+    return get_current_half_month() if period == "current" else "all"
+
+def attendance_sort_key(rank):
+    """排行榜排序鍵：出席次數高者在前，同次數依名稱、用戶ID"""
+    return (-rank['attended'], rank['username'], rank['user_id'])
+
+async def iter_attendance_ranking(guild_id=0, period: str = "current", after=None, limit=None):
+    """依排名順序串流用戶出席數據（async generator）
+    
+    有出席者來自 attendance_ranking 的排名索引，無出席者接在其後來自 users 的名稱索引；
+    after 為上一頁最後一筆的排序鍵（keyset 分頁），limit 為最多回傳筆數
+    """
     # 獲取總活動數
     total_events = await get_total_events_in_period(guild_id, period)
     
-    if total_events == 0:
-        return []
-    
-    async with aiosqlite.connect(DB_NAME) as conn:
-        # 獲取所有用戶
-        async with conn.execute("SELECT user_id, username, activity_stats FROM users WHERE guild_id = ?", (guild_id,)) as cursor:
-            results = await cursor.fetchall()
+    if total_events == 0 or limit == 0:
+        return
     
-    rankings = []
-    current_period = get_current_half_month()
+    period_id = attendance_period_id(period)
+    period_label = get_current_half_month() if period == "current" else "全部"
     
-    for user_id, username, activity_str in results:
-        if not activity_str:
-            attended_count = 0
+    # 依序執行的索引範圍查詢：同出席次數的後續用戶 → 較低出席次數 → 無出席紀錄的用戶
+    queries = []
+    if after is None or after[0] < 0:
+        if after is None:
+            queries.append(("""
+                SELECT user_id, username, attended FROM attendance_ranking
+                WHERE guild_id = ? AND period_id = ? AND attended > 0
+                ORDER BY attended DESC, username, user_id
+            """, (guild_id, period_id)))
         else:
-            activity_stats = json.loads(activity_str)
+            queries.append(("""
+                SELECT user_id, username, attended FROM attendance_ranking
+                WHERE guild_id = ? AND period_id = ? AND attended = ? AND (username, user_id) > (?, ?)
+                ORDER BY username, user_id
+            """, (guild_id, period_id, -after[0], after[1], after[2])))
+            queries.append(("""
+                SELECT user_id, username, attended FROM attendance_ranking
+                WHERE guild_id = ? AND period_id = ? AND attended > 0 AND attended < ?
+                ORDER BY attended DESC, username, user_id
+            """, (guild_id, period_id, -after[0])))
+        queries.append((f"""
+            SELECT u.user_id, u.username, 0 FROM users u
+            WHERE u.guild_id = ? AND {NO_ATTENDANCE_FILTER}
+            ORDER BY u.username, u.user_id
+        """, (guild_id, period_id)))
+    else:
+        queries.append((f"""
+            SELECT u.user_id, u.username, 0 FROM users u
+            WHERE u.guild_id = ? AND (u.username, u.user_id) > (?, ?) AND {NO_ATTENDANCE_FILTER}
+            ORDER BY u.username, u.user_id
+        """, (guild_id, after[1], after[2], period_id)))
+    
+    remaining = limit
+    async with db_pool.reader() as conn:
+        for query, params in queries:
+            if remaining is not None:
+                query += " LIMIT ?"
+                params += (remaining,)
             
-            if period == "current":
-                if current_period in activity_stats:
-                    data = activity_stats[current_period]
-                    attended_count = data.get("attended", 0)
-                else:
-                    attended_count = 0
+            async with conn.execute(query, params) as cursor:
+                async for user_id, username, attended_count in cursor:
+                    yield {
+                        'user_id': user_id,
+                        'username': username,
+                        'attendance_rate': (attended_count / total_events) * 100,
+                        'attended': attended_count,
+                        'total': total_events,
+                        'period': period_label
+                    }
+                    if remaining is not None:
+                        remaining -= 1
+            
+            if remaining == 0:
+                return
+
+class AttendanceSnapshot:
+    """某伺服器某期間的出席排名摘要：總人數、有出席者人數與已知的每頁 keyset 起點"""
+    
+    def __init__(self, version, user_count, total_events, attended_users):
+        self.version = version
+        self.user_count = user_count
+        self.total_users = user_count if total_events else 0
+        self.attended_users = attended_users  # attendance_ranking 中出席次數 > 0 的人數
+        self.page_after = {1: None}           # 頁數 -> 上一頁最後一筆的排序鍵
+    
+    @property
+    def total_pages(self):
+        return (self.total_users + ATTENDANCE_PAGE_SIZE - 1) // ATTENDANCE_PAGE_SIZE
+
+class AttendanceRankingCache:
+    """出席排名摘要快取：所有頁面與查看者共用，只在出席資料變動（版本號遞增）或用戶數改變時重建"""
+    
+    def __init__(self):
+        self.versions = {}   # guild_id -> 版本號
+        self.snapshots = {}  # (guild_id, 期間) -> AttendanceSnapshot
+        self.hits = 0
+        self.misses = 0
+    
+    def invalidate(self, guild_id):
+        self.versions[guild_id] = self.versions.get(guild_id, 0) + 1
+    
+    async def get(self, guild_id, period="current"):
+        # 「當前」以半月期ID為鍵，跨期後自然失效
+        key = (guild_id, attendance_period_id(period))
+        version = self.versions.get(guild_id, 0)
+        user_count = len(score_board.users.get(guild_id, {}))
+        
+        snapshot = self.snapshots.get(key)
+        if snapshot and snapshot.version == version and snapshot.user_count == user_count:
+            self.hits += 1
+            return snapshot
+        
+        self.misses += 1
+        total_events = await get_total_events_in_period(guild_id, period)
+        async with db_pool.reader() as conn:
+            async with conn.execute(
+                "SELECT COUNT(*) FROM attendance_ranking WHERE guild_id = ? AND period_id = ? AND attended > 0",
+                key
+            ) as cursor:
+                attended_users = (await cursor.fetchone())[0]
+        
+        snapshot = AttendanceSnapshot(version, user_count, total_events, attended_users)
+        self.snapshots[key] = snapshot
+        print(f"📊 出席排名摘要已重建: 伺服器 {guild_id}, {key[1]}, {snapshot.total_users} 人 (命中: {self.hits}, 未命中: {self.misses})")
+        return snapshot
+    
+    async def key_before(self, guild_id, period, snapshot, page):
+        """第 page 頁之前最後一筆的排序鍵：已知則直接使用，否則以索引 OFFSET 定位"""
+        if page in snapshot.page_after:
+            return snapshot.page_after[page]
+        
+        position = (page - 1) * ATTENDANCE_PAGE_SIZE - 1
+        period_id = attendance_period_id(period)
+        async with db_pool.reader() as conn:
+            if position < snapshot.attended_users:
+                async with conn.execute("""
+                    SELECT attended, username, user_id FROM attendance_ranking
+                    WHERE guild_id = ? AND period_id = ? AND attended > 0
+                    ORDER BY attended DESC, username, user_id
+                    LIMIT 1 OFFSET ?
+                """, (guild_id, period_id, position)) as cursor:
+                    row = await cursor.fetchone()
             else:
-                attended_count = 0
-                for period_key, data in activity_stats.items():
-                    attended_count += data.get("attended", 0)
-        
-        attendance_rate = (attended_count / total_events) * 100 if total_events > 0 else 0
+                async with conn.execute(f"""
+                    SELECT 0, u.username, u.user_id FROM users u
+                    WHERE u.guild_id = ? AND {NO_ATTENDANCE_FILTER}
+                    ORDER BY u.username, u.user_id
+                    LIMIT 1 OFFSET ?
+                """, (guild_id, period_id, position - snapshot.attended_users)) as cursor:
+                    row = await cursor.fetchone()
+        
+        key = (-row[0], row[1], row[2]) if row else None
+        snapshot.page_after[page] = key
+        return key
+    
+    async def page(self, guild_id, period, page):
+        """取得第 page 頁（從1開始）的排名資料"""
+        snapshot = await self.get(guild_id, period)
+        if page < 1 or page > snapshot.total_pages:
+            return []
+        
+        after = await self.key_before(guild_id, period, snapshot, page)
+        rankings = [
+            rank async for rank in iter_attendance_ranking(guild_id, period, after=after, limit=ATTENDANCE_PAGE_SIZE)
+        ]
+        if rankings:
+            snapshot.page_after[page + 1] = attendance_sort_key(rankings[-1])
+        return rankings
+    
+    async def rank_of(self, guild_id, period, user_id):
+        """用戶名次 = 排序在此用戶之前的人數 + 1，以索引範圍計數（未上榜為 (None, None)）"""
+        snapshot = await self.get(guild_id, period)
+        if not snapshot.total_users:
+            return None, None
+        
+        period_id = attendance_period_id(period)
+        async with db_pool.reader() as conn:
+            async with conn.execute("""
+                SELECT u.username, COALESCE(r.attended, 0)
+                FROM users u
+                LEFT JOIN attendance_ranking r 
+                    ON r.guild_id = u.guild_id AND r.period_id = ? AND r.user_id = u.user_id
+                WHERE u.guild_id = ? AND u.user_id = ?
+            """, (period_id, guild_id, user_id)) as cursor:
+                row = await cursor.fetchone()
+            
+            if not row:
+                return None, None
+            username, attended = row
+            
+            if attended > 0:
+                query = """
+                    SELECT (SELECT COUNT(*) FROM attendance_ranking
+                            WHERE guild_id = ? AND period_id = ? AND attended > ?)
+                         + (SELECT COUNT(*) FROM attendance_ranking
+                            WHERE guild_id = ? AND period_id = ? AND attended = ? AND (username, user_id) < (?, ?))
+                """
+                params = (guild_id, period_id, attended, guild_id, period_id, attended, username, user_id)
+            else:
+                query = f"""
+                    SELECT ? + (SELECT COUNT(*) FROM users u
+                                WHERE u.guild_id = ? AND (u.username, u.user_id) < (?, ?) AND {NO_ATTENDANCE_FILTER})
+                """
+                params = (snapshot.attended_users, guild_id, username, user_id, period_id)
+            
+            async with conn.execute(query, params) as cursor:
+                ahead = (await cursor.fetchone())[0]
         
-        rankings.append({
+        total_events = await get_total_events_in_period(guild_id, period)
+        return ahead + 1, {
             'user_id': user_id,
             'username': username,
-            'attendance_rate': attendance_rate,
-            'attended': attended_count,
+            'attendance_rate': (attended / total_events) * 100,
+            'attended': attended,
             'total': total_events,
-            'period': current_period if period == "current" else "全部"
-        })
-    
-    rankings.sort(key=lambda x: (-x['attendance_rate'], x['username']))
-    return rankings
+            'period': get_current_half_month() if period == "current" else "全部"
+        }
+
+attendance_cache = AttendanceRankingCache()
+
+GIVEAWAY_WINNER_FIELDS = 3          # 結束訊息中最多使用幾個欄位列出得獎者
+ANNOUNCE_MENTIONS_PER_MESSAGE = 50  # 每則公告最多標記人數
 
 async def end_giveaway(message_id: int, manual: bool = False, guild_id=0):
     """結束抽獎"""
+    start = time.perf_counter()
     try:
-        async with aiosqlite.connect(DB_NAME) as conn:
+        async with db_pool.reader() as conn:
             async with conn.execute("""
-                SELECT id, creator_id, prize, winner_count, participants, winners, channel_id 
+                SELECT id, creator_id, prize, winner_count, winners, channel_id 
                 FROM giveaways 
                 WHERE message_id = ? AND is_active = 1 AND guild_id = ?
             """, (message_id, guild_id)) as cursor:
                 result = await cursor.fetchone()
             
-            if not result:
-                return
+        if not result:
+            return
+        
+        giveaway_id, creator_id, prize, winner_count, winners_json, channel_id = result
+        
+        timer_scheduler.cancel(("giveaway_end", giveaway_id))
+        await state_actors.close("giveaway", giveaway_id)
+        participants = await get_giveaway_entries(giveaway_id)
+        channel = bot.get_channel(channel_id)
+        
+        if not channel:
+            return
+        
+        # 結束時只需要編輯訊息，不必抓取完整內容
+        message = channel.get_partial_message(message_id)
+        message_cache.discard(message_id)
+        embed_editor.cancel(message_id)
+        
+        if participants:
+            if len(participants) <= winner_count:
+                winners_list = participants
+            else:
+                winners_list = random.sample(participants, winner_count)
+            
+            async with db_pool.writer() as conn:
+                await conn.execute("UPDATE giveaways SET winners = ?, is_active = 0 WHERE id = ?", 
+                                 (json.dumps(winners_list), giveaway_id))
+                await conn.commit()
             
-            giveaway_id, creator_id, prize, winner_count, participants_json, winners_json, channel_id = result
+            message_router.unregister(message_id)
             
-            participants = json.loads(participants_json) if participants_json else []
-            channel = bot.get_channel(channel_id)
+            new_embed = discord.Embed(
+                title="🎉 抽獎已結束 🎉",
+                description="開獎完成！",
+                color=0x00FF00
+            )
             
-            if not channel:
-                return
+            new_embed.add_field(name="🎁 獎品", value=prize, inline=True)
+            new_embed.add_field(name="👑 中獎人數", value=str(len(winners_list)), inline=True)
+            new_embed.add_field(name="🎫 參與人數", value=f"{len(participants)} 人", inline=True)
             
-            try:
-                message = await channel.fetch_message(message_id)
-            except:
-                return
+            # 得獎者名單依欄位上限（1024 字元，保留附註空間）分段，放不下的部分由下方公告補足
+            winner_lines = [f"{i}. <@{winner_id}>" for i, winner_id in enumerate(winners_list, 1)]
+            winner_fields = chunk_text(winner_lines, 980)
+            shown = winner_fields[:GIVEAWAY_WINNER_FIELDS]
             
-            if participants:
-                if len(participants) <= winner_count:
-                    winners_list = participants
-                else:
-                    winners_list = random.sample(participants, winner_count)
-                
-                await conn.execute("UPDATE giveaways SET winners = ?, is_active = 0 WHERE id = ?", 
-                                 (json.dumps(winners_list), giveaway_id))
+            for index, field_text in enumerate(shown):
+                if index == len(shown) - 1 and len(winner_fields) > len(shown):
+                    listed = sum(field.count("\n") + 1 for field in shown)
+                    field_text += f"\n... 還有 {len(winners_list) - listed} 人（完整名單見下方公告）"
+                new_embed.add_field(name="🏆 獲獎者" if index == 0 else "🏆 獲獎者（續）", value=field_text, inline=False)
+            
+            await message.edit(embed=new_embed)
+            await message.clear_reactions()
+            
+            # 以最少訊息數公告所有得獎者（每則 2000 字元內）
+            header = f"🎉 恭喜以下 {len(winners_list)} 位得獎者獲得了 **{prize}**！"
+            mentions = chunk_text([f"<@{winner_id}>" for winner_id in winners_list], 2000 - len(header) - 1,
+                                  separator=" ", max_items=ANNOUNCE_MENTIONS_PER_MESSAGE)
+            
+            for index, mention_text in enumerate(mentions):
+                await channel.send(f"{header}\n{mention_text}" if index == 0 else mention_text)
+            
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            print(f"✅ 抽獎開獎完成: {prize}, 得獎者: {len(winners_list)}人, 公告訊息: {len(mentions)}則, 耗時: {elapsed_ms:.0f}ms")
+        else:
+            async with db_pool.writer() as conn:
+                await conn.execute("UPDATE giveaways SET is_active = 0 WHERE id = ?", (giveaway_id,))
                 await conn.commit()
-                
-                new_embed = discord.Embed(
-                    title="🎉 抽獎已結束 🎉",
-                    description="開獎完成！",
-                    color=0x00FF00
-                )
-                
-                new_embed.add_field(name="🎁 獎品", value=prize, inline=True)
-                new_embed.add_field(name="👑 中獎人數", value=str(len(winners_list)), inline=True)
-                new_embed.add_field(name="🎫 參與人數", value=f"{len(participants)} 人", inline=True)
-                
-                winners_text = ""
-                for i, winner_id in enumerate(winners_list[:5], 1):
-                    winners_text += f"{i}. <@{winner_id}>\n"
-                
-                if len(winners_list) > 5:
-                    winners_text += f"... 還有 {len(winners_list) - 5} 人"
-                
-                if winners_text:
-                    new_embed.add_field(name="🏆 獲獎者", value=winners_text, inline=False)
-                
-                await message.edit(embed=new_embed)
-                await message.clear_reactions()
-                
-                for winner_id in winners_list:
-                    await channel.send(f"🎉 恭喜 <@{winner_id}> 獲得了 **{prize}**！")
-            else:
-                new_embed = discord.Embed(
-                    title="🎉 抽獎已結束",
-                    description="無人參與抽獎" + ("（手動結束）" if manual else ""),
-                    color=0xFF0000
-                )
-                await message.edit(embed=new_embed)
-                await message.clear_reactions()
             
+            message_router.unregister(message_id)
+            
+            new_embed = discord.Embed(
+                title="🎉 抽獎已結束",
+                description="無人參與抽獎" + ("（手動結束）" if manual else ""),
+                color=0xFF0000
+            )
+            await message.edit(embed=new_embed)
+            await message.clear_reactions()
+        
     except Exception as e:
         print(f"結束抽獎錯誤: {e}")
 
 async def end_evaluation(event_id, channel, event_name, guild_id=0):
     """結束評核活動"""
     try:
-        async with aiosqlite.connect(DB_NAME) as conn:
+        # 先讓活動 actor 寫入尚未保存的簽到與職業
+        await state_actors.close("event", event_id)
+        
+        async with db_pool.writer() as conn:
             async with conn.execute("""
-                SELECT participants, professions, ratings, rating_message_id 
+                SELECT professions, rating_message_id, signup_message_id, profession_message_id 
                 FROM evaluation_events 
                 WHERE id = ? AND guild_id = ?
             """, (event_id, guild_id)) as cursor:
@@ -563,15 +2144,17 @@ async def end_evaluation(event_id, channel, event_name, guild_id=0):
             if not result:
                 return
             
-            participants_json, professions_json, ratings_json, rating_message_id = result
+            professions_json, rating_message_id, signup_message_id, profession_message_id = result
             
-            participants = json.loads(participants_json) if participants_json else []
+            participants = await get_event_participants(event_id)
             professions = json.loads(professions_json) if professions_json else {}
-            ratings = json.loads(ratings_json) if ratings_json else {}
+            rating_summary = await get_rating_distribution(event_id)
             
             await conn.execute("UPDATE evaluation_events SET is_active = 0 WHERE id = ?", (event_id,))
             await conn.commit()
         
+        message_router.unregister(signup_message_id, profession_message_id, rating_message_id)
+        
         try:
             rating_message = await channel.fetch_message(rating_message_id)
             await rating_message.clear_reactions()
@@ -584,12 +2167,6 @@ async def end_evaluation(event_id, channel, event_name, guild_id=0):
             
             end_embed.add_field(name="📊 統計信息", value=f"**總參與人數：** {len(participants)} 人", inline=False)
             
-            rating_summary = {}
-            for user_id, rating_list in ratings.items():
-                if rating_list:
-                    latest_rating = rating_list[-1]["rating"]
-                    rating_summary[latest_rating] = rating_summary.get(latest_rating, 0) + 1
-            
             rating_text = ""
             for rating_type in ["優秀", "良好", "普通", "不合格"]:
                 count = rating_summary.get(rating_type, 0)
@@ -612,7 +2189,7 @@ async def end_evaluation(event_id, channel, event_name, guild_id=0):
         
         summary_embed.add_field(name="👥 參與人數", value=f"{len(participants)} 人", inline=True)
         summary_embed.add_field(name="🎮 職業選擇", value=f"{len(professions)} 人", inline=True)
-        summary_embed.add_field(name="⭐ 評核完成", value=f"{len(ratings)} 人", inline=True)
+        summary_embed.add_field(name="⭐ 評核完成", value=f"{sum(rating_summary.values())} 人", inline=True)
         summary_embed.add_field(name="📊 評級分佈", value=f"{len(rating_summary)} 種評級", inline=True)
         
         await channel.send(embed=summary_embed)
@@ -630,6 +2207,184 @@ def get_guild_id(interaction_or_context):
         return interaction_or_context.message.guild.id if interaction_or_context.message.guild else 0
     return 0
 
+# ========== 倒數計時與重啟復原 ==========
+
+def arm_giveaway_timers(giveaway_id, message_id, guild_id, deadline):
+    """排程抽獎開獎（剩餘時間由 Discord 時間戳自行倒數，不需定期編輯）"""
+    timer_scheduler.schedule(deadline, ("giveaway_end", giveaway_id),
+                             lambda: end_giveaway(message_id, guild_id=guild_id))
+
+async def close_event_signup(event_id):
+    """簽到時間結束：結算簽到並建立評核階段訊息"""
+    timer_scheduler.cancel(("signup_close", event_id))
+    
+    async with db_pool.reader() as conn:
+        async with conn.execute("""
+            SELECT event_name, prize, channel_id, signup_message_id, guild_id 
+            FROM evaluation_events 
+            WHERE id = ? AND is_active = 1 AND rating_message_id IS NULL
+        """, (event_id,)) as cursor:
+            event = await cursor.fetchone()
+    
+    if not event:
+        return
+    
+    event_name, prize, channel_id, signup_message_id, guild_id = event
+    channel = bot.get_channel(channel_id)
+    if not channel:
+        print(f"⚠️ 找不到活動 {event_id} 的頻道，無法結束簽到")
+        return
+    
+    signup_message = channel.get_partial_message(signup_message_id)
+    
+    # 簽到時間結束，處理簽到結果
+    try:
+        # 為所有參與者發放簽到獎勵（單一交易）
+        await state_actors.close("event", event_id)
+        participants, _ = await settle_event_signups(event_id, event_name, guild_id)
+        
+        # 更新簽到訊息
+        end_embed = discord.Embed(
+            title=f"📋 評核活動：{event_name}",
+            description="**簽到已結束！所有參與者已獲得預設「普通」評級（0積分）**",
+            color=discord.Color.red()
+        )
+        
+        if prize:
+            end_embed.add_field(name="🎁 獎品", value=prize, inline=False)
+        
+        end_embed.add_field(name="⏰ 簽到時間", value="已結束", inline=True)
+        end_embed.add_field(name="👥 已簽到", value=f"{len(participants)} 人", inline=True)
+        
+        if participants:
+            participants_text = "\n".join([f"<@{user_id}>" for user_id in participants[:10]])
+            if len(participants) > 10:
+                participants_text += f"\n... 還有 {len(participants) - 10} 人"
+            
+            end_embed.add_field(name="📋 參與者列表", value=participants_text, inline=False)
+        
+        end_embed.add_field(name="📝 評核說明", value="主持人現在可以按EMOJI調整評級：\n⭐ 優秀 (+40分)\n👍 良好 (+10分)\n👌 普通 (0分，預設)\n❌ 不合格 (-5分)", inline=False)
+        end_embed.set_footer(text="半月期活動統計已更新 | 簽到積分已發放 | 預設評級：普通")
+        
+        embed_editor.cancel(signup_message.id)
+        message_cache.discard(signup_message.id)
+        try:
+            await signup_message.edit(embed=end_embed)
+            await signup_message.clear_reactions()
+        except discord.HTTPException as e:
+            # 已結算，不影響評核訊息建立
+            print(f"⚠️ 更新簽到訊息失敗: {e}")
+        
+        print(f"✅ 簽到結束: {event_name}, 參與者: {len(participants)}人, 已給予預設普通評級")
+        
+        # 創建評核階段訊息
+        rating_embed = discord.Embed(
+            title=f"⭐ 評核階段：{event_name}",
+            description="**主持人可以按下方EMOJI調整評級**\n\n"
+                      f"所有參與者已獲得預設「普通」評級（{RATING_SCORES['普通']}積分）\n"
+                      f"請主持人針對表現優秀或需要改進的成員調整評級：\n\n"
+                      f"⭐ 優秀：+{RATING_SCORES['優秀']}積分\n"
+                      f"👍 良好：+{RATING_SCORES['良好']}積分\n"
+                      f"👌 普通：{RATING_SCORES['普通']}積分（預設）\n"
+                      f"❌ 不合格：{RATING_SCORES['不合格']}積分\n\n"
+                      f"**使用方法：**\n1. 點擊下方對應的EMOJI\n2. 在彈出的視窗中選擇用戶\n3. 系統會自動更新評級",
+            color=discord.Color.gold()
+        )
+        
+        if participants:
+            rating_embed.add_field(
+                name="👥 參與者列表",
+                value="\n".join([f"<@{user_id}>" for user_id in participants[:15]]) + 
+                     (f"\n... 還有 {len(participants)-15} 人" if len(participants) > 15 else ""),
+                inline=False
+            )
+        
+        rating_msg = await channel.send(embed=rating_embed)
+        
+        # 添加評核反應
+        for emoji in ["⭐", "👍", "👌", "❌", RATING_END_EMOJI]:
+            await rating_msg.add_reaction(emoji)
+        
+        # 儲存評核訊息ID
+        async with db_pool.writer() as conn:
+            await conn.execute("UPDATE evaluation_events SET rating_message_id = ? WHERE id = ?", 
+                             (rating_msg.id, event_id))
+            await conn.commit()
+        
+        message_router.register(rating_msg.id, "rating", event_id, guild_id)
+        
+        print(f"✅ 評核階段已創建: {event_name}, 評核訊息ID: {rating_msg.id}")
+        
+    except Exception as e:
+        print(f"簽到結束處理錯誤: {e}")
+
+def arm_signup_timers(event_id, deadline):
+    """排程簽到結束"""
+    timer_scheduler.schedule(deadline, ("signup_close", event_id), lambda: close_event_signup(event_id))
+
+def parse_db_timestamp(value):
+    """資料庫中的本地時間字串 → time.time() 時間戳"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        return None
+
+async def recover_timers():
+    """重新啟動後恢復進行中的抽獎與簽到：逾期者立即結束，其餘重新排程"""
+    await bot.wait_until_ready()
+    start = time.perf_counter()
+    
+    async with db_pool.reader() as conn:
+        async with conn.execute("""
+            SELECT id, message_id, guild_id, end_time 
+            FROM giveaways 
+            WHERE is_active = 1
+        """) as cursor:
+            giveaways = await cursor.fetchall()
+        
+        async with conn.execute("""
+            SELECT id, signup_end_time, signup_settled_at 
+            FROM evaluation_events 
+            WHERE is_active = 1 AND rating_message_id IS NULL AND signup_end_time IS NOT NULL
+        """) as cursor:
+            events = await cursor.fetchall()
+    
+    now = time.time()
+    overdue = []
+    giveaways_armed = giveaways_overdue = signups_armed = signups_overdue = ratings_rebuilt = 0
+    
+    for giveaway_id, message_id, guild_id, end_time in giveaways:
+        deadline = parse_db_timestamp(end_time)
+        if deadline is None or deadline <= now:
+            overdue.append(end_giveaway(message_id, guild_id=guild_id))
+            giveaways_overdue += 1
+        else:
+            arm_giveaway_timers(giveaway_id, message_id, guild_id, deadline)
+            giveaways_armed += 1
+    
+    for event_id, signup_end_time, signup_settled_at in events:
+        deadline = parse_db_timestamp(signup_end_time)
+        if signup_settled_at:
+            # 已結算但評核訊息未建立：只補建評核訊息
+            overdue.append(close_event_signup(event_id))
+            ratings_rebuilt += 1
+        elif deadline is None or deadline <= now:
+            overdue.append(close_event_signup(event_id))
+            signups_overdue += 1
+        else:
+            arm_signup_timers(event_id, deadline)
+            signups_armed += 1
+    
+    # 逾期項目一次併發處理
+    results = await asyncio.gather(*overdue, return_exceptions=True)
+    failed = sum(1 for result in results if isinstance(result, Exception))
+    
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print(f"✅ 計時器復原完成 (抽獎: 重新排程 {giveaways_armed}, 逾期開獎 {giveaways_overdue} | "
+          f"簽到: 重新排程 {signups_armed}, 逾期結算 {signups_overdue}, 補建評核訊息 {ratings_rebuilt} | 失敗 {failed}, 耗時 {elapsed_ms:.0f}ms)")
+
 # ========== 同步指令 ==========
 
 @tree.command(name="sync", description="同步斜槓指令（擁有者）")
@@ -734,13 +2489,16 @@ async def profile_slash(interaction: discord.Interaction):
         profile = await get_user_profile(user_id, guild_id)
         
         if not profile:
-            async with aiosqlite.connect(DB_NAME) as conn:
-                await conn.execute(
+            async with db_pool.writer() as conn:
+                cursor = await conn.execute(
                     "INSERT OR IGNORE INTO users (user_id, username, current_score, total_score, guild_id) VALUES (?, ?, ?, ?, ?)",
                     (user_id, username, 0, 0, guild_id)
                 )
                 await conn.commit()
             
+            if cursor.rowcount > 0:
+                score_board.update(guild_id, user_id, 0, 0, username)
+            
             profile = {
                 'user_id': user_id,
                 'current_score': 0,
@@ -760,7 +2518,7 @@ async def profile_slash(interaction: discord.Interaction):
         
         current_period = get_current_half_month()
         period_data = activity_stats.get(current_period, {})
-        total_events = period_data.get('total', 0)
+        total_events = await get_total_events_in_period(guild_id, "current")
         attended_events = period_data.get('attended', 0)
         attendance_rate = (attended_events / total_events * 100) if total_events > 0 else 0.0
         
@@ -900,19 +2658,7 @@ async def giveaway_slash(
             return
         
         end_time = datetime.now() + timedelta(seconds=seconds)
-        
-        if seconds < 60:
-            time_display = f"{seconds}秒"
-        elif seconds < 3600:
-            time_display = f"{seconds//60}分{seconds%60}秒"
-        elif seconds < 86400:
-            hours = seconds // 3600
-            minutes = (seconds % 3600) // 60
-            time_display = f"{hours}小時{minutes}分"
-        else:
-            days = seconds // 86400
-            hours = (seconds % 86400) // 3600
-            time_display = f"{days}天{hours}小時"
+        deadline = end_time.timestamp()
         
         embed = discord.Embed(
             title="🎉 自動抽獎活動 🎉",
@@ -922,7 +2668,7 @@ async def giveaway_slash(
         
         embed.add_field(name="🎁 獎品", value=prize, inline=True)
         embed.add_field(name="👑 中獎人數", value=str(winners), inline=True)
-        embed.add_field(name="⏰ 結束時間", value=time_display, inline=True)
+        embed.add_field(name="⏰ 結束時間", value=discord_timestamp(deadline), inline=True)
         embed.add_field(name="🎫 參與人數", value="0 人", inline=True)
         embed.add_field(name="📝 參與方式", value="點擊下方 🎫 按鈕參與", inline=True)
         embed.add_field(name="🔧 主辦人操作", value="點擊 ⏹️ 手動結束抽獎", inline=True)
@@ -935,74 +2681,25 @@ async def giveaway_slash(
         
         await interaction.followup.send(embed=embed)
         message = await interaction.original_response()
+        message_cache.put(message)
         
         await message.add_reaction("🎫")
         await message.add_reaction("⏹️")
         
-        async with aiosqlite.connect(DB_NAME) as conn:
-            await conn.execute('''
+        async with db_pool.writer() as conn:
+            cursor = await conn.execute('''
                 INSERT INTO giveaways (creator_id, prize, winner_count, end_time, message_id, channel_id, guild_id)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
             ''', (interaction.user.id, prize, winners, end_time, message.id, interaction.channel.id, guild_id))
+            giveaway_row_id = cursor.lastrowid
             await conn.commit()
         
-        print(f"✅ 抽獎已創建: 獎品={prize}, 時間={seconds}秒, 訊息ID={message.id}")
+        message_router.register(message.id, "giveaway", giveaway_row_id, guild_id)
         
-        async def countdown_timer():
-            remaining = seconds
-            last_update = time.time()
-            
-            while remaining > 0:
-                await asyncio.sleep(1)
-                remaining -= 1
-                
-                if time.time() - last_update >= 30:
-                    if remaining < 60:
-                        time_display = f"{remaining}秒"
-                    elif remaining < 3600:
-                        time_display = f"{remaining//60}分{remaining%60}秒"
-                    elif remaining < 86400:
-                        hours = remaining // 3600
-                        minutes = (remaining % 3600) // 60
-                        time_display = f"{hours}小時{minutes}分"
-                    else:
-                        days = remaining // 86400
-                        hours = (remaining % 86400) // 3600
-                        time_display = f"{days}天{hours}小時"
-                    
-                    try:
-                        async with aiosqlite.connect(DB_NAME) as conn:
-                            async with conn.execute("SELECT participants FROM giveaways WHERE message_id = ? AND guild_id = ?", (message.id, guild_id)) as cursor:
-                                result = await cursor.fetchone()
-                                participants_count = 0
-                                if result and result[0]:
-                                    participants = json.loads(result[0])
-                                    participants_count = len(participants)
-                        
-                        new_embed = discord.Embed(
-                            title="🎉 自動抽獎活動 🎉",
-                            description="時間到自動開獎！",
-                            color=0xFFD700
-                        )
-                        
-                        new_embed.add_field(name="🎁 獎品", value=prize, inline=True)
-                        new_embed.add_field(name="👑 中獎人數", value=str(winners), inline=True)
-                        new_embed.add_field(name="⏰ 結束時間", value=f"{time_display}內", inline=True)
-                        new_embed.add_field(name="🎫 參與人數", value=f"{participants_count} 人", inline=True)
-                        new_embed.add_field(name="📝 參與方式", value="點擊下方 🎫 按鈕參與", inline=True)
-                        new_embed.add_field(name="🔧 主辦人操作", value="點擊 ⏹️ 手動結束抽獎", inline=True)
-                        
-                        new_embed.set_footer(text=f"抽獎ID: {giveaway_id} | 主辦人: {creator_name}•{datetime.now().strftime('%Y-%m-%d %H:%M')}")
-                        
-                        await message.edit(embed=new_embed)
-                        last_update = time.time()
-                        
-                    except Exception as e:
-                        print(f"更新抽獎訊息錯誤: {e}")
-            
-            await end_giveaway(message.id, guild_id=guild_id)
+        print(f"✅ 抽獎已創建: 獎品={prize}, 時間={seconds}秒, 訊息ID={message.id}")
         
-        asyncio.create_task(countdown_timer())
+        # 以絕對期限排程開獎；參與人數只在有人加入時更新
+        arm_giveaway_timers(giveaway_row_id, message.id, guild_id, deadline)
         
     except Exception as e:
         error_embed = discord.Embed(
@@ -1078,14 +2775,6 @@ async def score_draw_slash(interaction: discord.Interaction):
                     await interaction.response.send_message("❌ 這不是你的抽獎！", ephemeral=True)
                     return
                 
-                current_score, _ = await get_user_score(interaction.user.id, self.guild_id)
-                if current_score < score_cost:
-                    await interaction.response.send_message(
-                        f"❌ 積分不足！需要 {score_cost} 分，你目前有 {current_score} 分",
-                        ephemeral=True
-                    )
-                    return
-                
                 weights = {
                     50: {"綠箱": 70, "藍箱": 25, "紫箱": 4.5, "金箱": 0.5},
                     100: {"綠箱": 50, "藍箱": 40, "紫箱": 9, "金箱": 1},
@@ -1097,30 +2786,46 @@ async def score_draw_slash(interaction: discord.Interaction):
                 box_weights_list = list(box_weights.values())
                 selected_box = random.choices(box_types, weights=box_weights_list, k=1)[0]
                 
-                async with aiosqlite.connect(DB_NAME) as conn:
-                    async with conn.execute(
-                        "SELECT id, prize_name FROM prize_pool WHERE box_level = ? AND remaining > 0 AND guild_id = ? ORDER BY RANDOM() LIMIT 1",
-                        (selected_box, self.guild_id)
-                    ) as cursor:
-                        result = await cursor.fetchone()
-                    
-                    if not result:
-                        await interaction.response.send_message(f"❌ {selected_box}中沒有可用獎品！", ephemeral=True)
-                        return
+                result = None
+                async with db_pool.writer() as conn:
+                    # 餘額在寫入連線內檢查，連續點擊也不會重複扣成負分
+                    async with conn.execute("SELECT current_score FROM users WHERE user_id = ? AND guild_id = ?", (interaction.user.id, self.guild_id)) as cursor:
+                        balance = await cursor.fetchone()
+                    current_score = balance[0] if balance else 0
                     
-                    prize_id, prize_name = result
-                    
-                    await update_user_score(interaction.user.id, interaction.user.name, -score_cost, f"積分抽獎 ({selected_box})", self.guild_id)
-                    await conn.execute("UPDATE prize_pool SET remaining = remaining - 1 WHERE id = ?", (prize_id,))
-                    
-                    await conn.execute('''
-                        INSERT INTO score_draws (creator_id, score_cost, box_level, winner_prize, winner_id, guild_id)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (interaction.user.id, score_cost, selected_box, prize_name, interaction.user.id, self.guild_id))
+                    if current_score >= score_cost:
+                        async with conn.execute(
+                            "SELECT id, prize_name FROM prize_pool WHERE box_level = ? AND remaining > 0 AND guild_id = ? ORDER BY RANDOM() LIMIT 1",
+                            (selected_box, self.guild_id)
+                        ) as cursor:
+                            result = await cursor.fetchone()
                     
-                    await conn.commit()
+                    if result:
+                        prize_id, prize_name = result
+                        
+                        # 扣分、扣獎品與抽獎紀錄在同一交易內完成
+                        new_current_score, new_total_score = await write_score_entry(conn, interaction.user.id, interaction.user.name, -score_cost, f"積分抽獎 ({selected_box})", self.guild_id)
+                        await conn.execute("UPDATE prize_pool SET remaining = remaining - 1 WHERE id = ?", (prize_id,))
+                        
+                        await conn.execute('''
+                            INSERT INTO score_draws (creator_id, score_cost, box_level, winner_prize, winner_id, guild_id)
+                            VALUES (?, ?, ?, ?, ?, ?)
+                        ''', (interaction.user.id, score_cost, selected_box, prize_name, interaction.user.id, self.guild_id))
+                        
+                        await conn.commit()
+                        score_board.update(self.guild_id, interaction.user.id, new_current_score, new_total_score, interaction.user.name)
+                
+                if current_score < score_cost:
+                    await interaction.response.send_message(
+                        f"❌ 積分不足！需要 {score_cost} 分，你目前有 {current_score} 分",
+                        ephemeral=True
+                    )
+                    return
+                
+                if not result:
+                    await interaction.response.send_message(f"❌ {selected_box}中沒有可用獎品！", ephemeral=True)
+                    return
                 
-                new_current_score, _ = await get_user_score(interaction.user.id, self.guild_id)
                 
                 result_embed = discord.Embed(
                     title="🎉 抽獎結果",
@@ -1179,25 +2884,13 @@ async def score_transfer_slash(
             await interaction.followup.send("❌ 不能轉移積分給自己")
             return
         
-        sender_score, _ = await get_user_score(interaction.user.id, guild_id)
+        # 餘額檢查與雙方積分變動在同一交易內完成
+        success, new_sender_score = await transfer_user_score(interaction.user, user, amount, reason, guild_id)
         
-        if sender_score < amount:
-            await interaction.followup.send(f"❌ 你的積分不足！需要 {amount} 分，你目前有 {sender_score} 分")
+        if not success:
+            await interaction.followup.send(f"❌ 你的積分不足！需要 {amount} 分，你目前有 {new_sender_score} 分")
             return
         
-        async with aiosqlite.connect(DB_NAME) as conn:
-            await update_user_score(interaction.user.id, interaction.user.name, -amount, f"轉移給 {user.name}", guild_id)
-            await update_user_score(user.id, user.name, amount, f"來自 {interaction.user.name} 的轉移", guild_id)
-            
-            await conn.execute('''
-                INSERT INTO score_transfers (from_user_id, to_user_id, amount, reason, guild_id)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (interaction.user.id, user.id, amount, reason or "無", guild_id))
-            
-            await conn.commit()
-        
-        new_sender_score, _ = await get_user_score(interaction.user.id, guild_id)
-        
         embed = discord.Embed(
             title="💸 積分轉移成功",
             description=f"**轉出：** {interaction.user.mention}\n"
@@ -1227,7 +2920,7 @@ async def prizelist_slash(interaction: discord.Interaction):
         guild_id = get_guild_id(interaction)
         await log_query("prizelist", interaction.user.id, {"action": "view_pool"}, guild_id)
         
-        async with aiosqlite.connect(DB_NAME) as conn:
+        async with db_pool.reader() as conn:
             async with conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='prize_pool'") as cursor:
                 if not await cursor.fetchone():
                     embed = discord.Embed(
@@ -1403,7 +3096,7 @@ async def random_team_slash(
                         
                         new_embed.set_footer(text=f"等待主持人開始... ({len(participants)}人參加)")
                         
-                        await message.edit(embed=new_embed)
+                        embed_editor.request(message, new_embed)
                         
                 elif str(reaction.emoji) == "▶️" and user.id == interaction.user.id:
                     if len(participants) < 2:
@@ -1454,6 +3147,7 @@ async def random_team_slash(
                             inline=False
                         )
                     
+                    embed_editor.cancel(message.id)
                     await message.channel.send(embed=result_embed)
                     await message.clear_reactions()
                     break
@@ -1464,6 +3158,7 @@ async def random_team_slash(
                 description="分組時間已過",
                 color=0xFF0000
             )
+            embed_editor.cancel(message.id)
             await message.edit(embed=timeout_embed)
             await message.clear_reactions()
             
@@ -1484,16 +3179,8 @@ async def score_ranking_slash(interaction: discord.Interaction):
         guild_id = get_guild_id(interaction)
         await log_query("score_ranking", interaction.user.id, {"action": "view_ranking"}, guild_id)
         
-        async with aiosqlite.connect(DB_NAME) as conn:
-            # 獲取排行榜
-            async with conn.execute("""
-                SELECT user_id, username, current_score, total_score 
-                FROM users 
-                WHERE guild_id = ? 
-                ORDER BY current_score DESC 
-                LIMIT 15
-            """, (guild_id,)) as cursor:
-                results = await cursor.fetchall()
+        # 排行榜與個人名次皆由記憶體中的排序結構取得，不需查詢資料庫
+        results = score_board.top(guild_id, 15)
         
         if not results:
             embed = discord.Embed(
@@ -1526,15 +3213,7 @@ async def score_ranking_slash(interaction: discord.Interaction):
         embed.add_field(name="🏅 排名", value=ranking_text, inline=False)
         
         # 添加當前用戶排名
-        async with aiosqlite.connect(DB_NAME) as conn:
-            async with conn.execute("""
-                SELECT COUNT(*) FROM users 
-                WHERE guild_id = ? AND current_score > (
-                    SELECT current_score FROM users WHERE user_id = ? AND guild_id = ?
-                )
-            """, (guild_id, interaction.user.id, guild_id)) as cursor:
-                higher_count = (await cursor.fetchone())[0]
-                user_rank = higher_count + 1
+        user_rank = score_board.rank(guild_id, interaction.user.id)
         
         embed.add_field(
             name="📊 你的排名",
@@ -1574,10 +3253,10 @@ async def attendance_ranking_slash(
             await interaction.followup.send("❌ 頁數必須大於 0")
             return
         
-        # 獲取所有出席數據
-        rankings = await get_all_attendance_data(guild_id, period)
+        # 獲取出席排名索引（所有頁面與查看者共用）
+        snapshot = await attendance_cache.get(guild_id, period)
         
-        if not rankings:
+        if not snapshot.total_users:
             embed = discord.Embed(
                 title="📊 出席率排行榜",
                 description="目前還沒有出席率數據",
@@ -1587,9 +3266,9 @@ async def attendance_ranking_slash(
             return
         
         # 分頁設定
-        users_per_page = 100  # 每頁顯示100人
-        total_users = len(rankings)
-        total_pages = (total_users + users_per_page - 1) // users_per_page
+        users_per_page = ATTENDANCE_PAGE_SIZE
+        total_users = snapshot.total_users
+        total_pages = snapshot.total_pages
         
         if page > total_pages:
             await interaction.followup.send(f"❌ 只有 {total_pages} 頁，無法顯示第 {page} 頁")
@@ -1598,7 +3277,7 @@ async def attendance_ranking_slash(
         # 計算當前頁的起始和結束索引
         start_idx = (page - 1) * users_per_page
         end_idx = min(start_idx + users_per_page, total_users)
-        current_page_rankings = rankings[start_idx:end_idx]
+        current_page_rankings = await attendance_cache.page(guild_id, period, page)
         
         period_text = "當前半月期" if period == "current" else "全部期間"
         
@@ -1652,14 +3331,9 @@ async def attendance_ranking_slash(
             )
         
         # 添加當前用戶的排名
-        current_user_rank = None
-        for i, rank in enumerate(rankings, 1):
-            if rank['user_id'] == interaction.user.id:
-                current_user_rank = i
-                break
+        current_user_rank, user_rank = await attendance_cache.rank_of(guild_id, period, interaction.user.id)
         
         if current_user_rank:
-            user_rank = rankings[current_user_rank - 1]
             user_page = ((current_user_rank - 1) // users_per_page) + 1
             
             user_rank_text = f"**你的排名：** 第 {current_user_rank} 名 (在第 {user_page} 頁)\n"
@@ -1704,10 +3378,10 @@ async def attendance_ranking_slash(
             async def show_page(self, interaction: discord.Interaction, page: int):
                 await interaction.response.defer()
                 
-                # 獲取新頁面的數據
-                rankings = await get_all_attendance_data(self.guild_id, self.period)
-                total_users = len(rankings)
-                total_pages = (total_users + users_per_page - 1) // users_per_page
+                # 獲取新頁面的數據（快照未變動時直接使用快取）
+                snapshot = await attendance_cache.get(self.guild_id, self.period)
+                total_users = snapshot.total_users
+                total_pages = snapshot.total_pages
                 
                 if page < 1 or page > total_pages:
                     await interaction.followup.send(f"❌ 頁數必須在 1-{total_pages} 之間", ephemeral=True)
@@ -1716,7 +3390,7 @@ async def attendance_ranking_slash(
                 # 計算新頁面的起始和結束索引
                 start_idx = (page - 1) * users_per_page
                 end_idx = min(start_idx + users_per_page, total_users)
-                current_page_rankings = rankings[start_idx:end_idx]
+                current_page_rankings = await attendance_cache.page(self.guild_id, self.period, page)
                 
                 period_text = "當前半月期" if self.period == "current" else "全部期間"
                 
@@ -1767,14 +3441,9 @@ async def attendance_ranking_slash(
                     )
                 
                 # 更新用戶排名
-                current_user_rank = None
-                for i, rank in enumerate(rankings, 1):
-                    if rank['user_id'] == interaction.user.id:
-                        current_user_rank = i
-                        break
+                current_user_rank, user_rank = await attendance_cache.rank_of(self.guild_id, self.period, interaction.user.id)
                 
                 if current_user_rank:
-                    user_rank = rankings[current_user_rank - 1]
                     user_page = ((current_user_rank - 1) // users_per_page) + 1
                     
                     user_rank_text = f"**你的排名：** 第 {current_user_rank} 名 (在第 {user_page} 頁)\n"
@@ -1872,78 +3541,84 @@ async def add_prize_slash(
             await interaction.followup.send(f"❌ 無效的寶箱等級！請選擇：{', '.join(valid_levels)}")
             return
         
-        async with aiosqlite.connect(DB_NAME) as conn:
+        if quantity == 0:
+            await interaction.followup.send("❌ 數量不能為 0")
+            return
+        
+        async with db_pool.writer() as conn:
             async with conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='prize_pool'") as cursor:
-                if not await cursor.fetchone():
-                    error_embed = discord.Embed(
-                        title="❌ 彩池表格不存在",
-                        description="請重新啟動機器人以初始化資料庫",
-                        color=0xFF0000
-                    )
-                    await interaction.followup.send(embed=error_embed)
-                    return
+                table_exists = await cursor.fetchone() is not None
             
-            if quantity > 0:
-                await conn.execute('''
-                    INSERT INTO prize_pool (prize_name, box_level, quantity, remaining, added_by, guild_id)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                    ON CONFLICT(prize_name, box_level, guild_id) 
-                    DO UPDATE SET 
-                        quantity = quantity + excluded.quantity,
-                        remaining = remaining + excluded.quantity
-                ''', (name, box_level, quantity, quantity, interaction.user.id, guild_id))
-                
-                action = "添加"
-            elif quantity < 0:
-                await conn.execute('''
-                    UPDATE prize_pool 
-                    SET quantity = quantity + ?,
-                        remaining = CASE 
-                                        WHEN remaining + ? > 0 THEN remaining + ?
-                                        ELSE 0
-                                    END
-                    WHERE prize_name = ? AND box_level = ? AND guild_id = ?
-                ''', (quantity, quantity, quantity, name, box_level, guild_id))
-                
-                if (await conn.total_changes) == 0:
-                    await interaction.followup.send(f"❌ 找不到獎品 '{name}' 在 {box_level} 中")
-                    return
+            result = None
+            if table_exists:
+                if quantity > 0:
+                    await conn.execute('''
+                        INSERT INTO prize_pool (prize_name, box_level, quantity, remaining, added_by, guild_id)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                        ON CONFLICT(prize_name, box_level, guild_id) 
+                        DO UPDATE SET 
+                            quantity = quantity + excluded.quantity,
+                            remaining = remaining + excluded.quantity
+                    ''', (name, box_level, quantity, quantity, interaction.user.id, guild_id))
+                    updated = True
+                else:
+                    cursor = await conn.execute('''
+                        UPDATE prize_pool 
+                        SET quantity = quantity + ?,
+                            remaining = CASE 
+                                            WHEN remaining + ? > 0 THEN remaining + ?
+                                            ELSE 0
+                                        END
+                        WHERE prize_name = ? AND box_level = ? AND guild_id = ?
+                    ''', (quantity, quantity, quantity, name, box_level, guild_id))
+                    updated = cursor.rowcount > 0
                 
-                action = "減少"
-            else:
-                await interaction.followup.send("❌ 數量不能為 0")
-                return
+                if updated:
+                    async with conn.execute("SELECT quantity, remaining FROM prize_pool WHERE prize_name = ? AND box_level = ? AND guild_id = ?", 
+                                  (name, box_level, guild_id)) as cursor:
+                        result = await cursor.fetchone()
+                    
+                    await conn.commit()
+        
+        if not table_exists:
+            error_embed = discord.Embed(
+                title="❌ 彩池表格不存在",
+                description="請重新啟動機器人以初始化資料庫",
+                color=0xFF0000
+            )
+            await interaction.followup.send(embed=error_embed)
+            return
+        
+        if not updated:
+            await interaction.followup.send(f"❌ 找不到獎品 '{name}' 在 {box_level} 中")
+            return
+        
+        action = "添加" if quantity > 0 else "減少"
+        
+        if result:
+            total_qty, remaining_qty = result
             
-            async with conn.execute("SELECT quantity, remaining FROM prize_pool WHERE prize_name = ? AND box_level = ? AND guild_id = ?", 
-                          (name, box_level, guild_id)) as cursor:
-                result = await cursor.fetchone()
+            embed = discord.Embed(
+                title=f"✅ 獎品{action}成功",
+                color=0x2ECC71 if quantity > 0 else 0xE74C3C
+            )
             
-            if result:
-                total_qty, remaining_qty = result
-                
-                embed = discord.Embed(
-                    title=f"✅ 獎品{action}成功",
-                    color=0x2ECC71 if quantity > 0 else 0xE74C3C
-                )
-                
-                embed.add_field(name="獎品名稱", value=name, inline=True)
-                embed.add_field(name="寶箱等級", value=box_level, inline=True)
-                embed.add_field(name=f"{action}數量", value=f"{abs(quantity)} 個", inline=True)
-                embed.add_field(name="總數量", value=f"{total_qty} 個", inline=True)
-                embed.add_field(name="剩餘數量", value=f"{remaining_qty} 個", inline=True)
-                embed.add_field(name="操作者", value=interaction.user.mention, inline=True)
-                
-                await interaction.followup.send(embed=embed)
-            else:
-                await interaction.followup.send(f"❌ 操作失敗")
+            embed.add_field(name="獎品名稱", value=name, inline=True)
+            embed.add_field(name="寶箱等級", value=box_level, inline=True)
+            embed.add_field(name=f"{action}數量", value=f"{abs(quantity)} 個", inline=True)
+            embed.add_field(name="總數量", value=f"{total_qty} 個", inline=True)
+            embed.add_field(name="剩餘數量", value=f"{remaining_qty} 個", inline=True)
+            embed.add_field(name="操作者", value=interaction.user.mention, inline=True)
             
-            await conn.commit()
+            await interaction.followup.send(embed=embed)
+        else:
+            await interaction.followup.send(f"❌ 操作失敗")
             
     except sqlite3.OperationalError as e:
         if "no such column" in str(e) or "no such table" in str(e):
             error_embed = discord.Embed(
                 title="❌ 資料庫結構錯誤",
-                description="請刪除 bot_data.db 檔案後重新啟動機器人",
+                description="資料庫結構尚未更新，請重新啟動機器人以執行資料庫遷移",
                 color=0xFF0000
             )
             await interaction.followup.send(embed=error_embed)
@@ -1990,8 +3665,8 @@ async def add_score_slash(
             return
         
         old_score, old_total = await get_user_score(user.id, guild_id)
-        await update_user_score(user.id, user.name, amount, f"管理員調整: {reason}", guild_id)
-        new_score, new_total = await get_user_score(user.id, guild_id)
+        balances = await apply_score_changes([(user.id, user.name, amount, f"管理員調整: {reason}")], guild_id)
+        new_score, new_total = balances[user.id]
         
         action = "增加" if amount > 0 else "減少"
         embed = discord.Embed(
@@ -2040,6 +3715,9 @@ async def create_event_slash(
         guild_id = get_guild_id(interaction)
         await log_query("create_event", interaction.user.id, {"event_name": event_name, "signup_time": signup_time, "prize": prize}, guild_id)
         
+        signup_end_time = datetime.now() + timedelta(minutes=signup_time)
+        signup_deadline = signup_end_time.timestamp()
+        
         # 創建簽到訊息
         signup_embed = discord.Embed(
             title=f"📋 評核活動：{event_name}",
@@ -2057,10 +3735,11 @@ async def create_event_slash(
         
         signup_embed.add_field(name="⏰ 簽到時間", value=f"{signup_time} 分鐘", inline=True)
         signup_embed.add_field(name="👥 已簽到", value="0 人", inline=True)
-        signup_embed.add_field(name="⏱️ 剩餘時間", value=f"{signup_time} 分鐘", inline=True)
+        signup_embed.add_field(name="⏱️ 剩餘時間", value=discord_timestamp(signup_deadline), inline=True)
         signup_embed.set_footer(text=f"半月期: {get_current_half_month()}")
         
         signup_message = await interaction.followup.send(embed=signup_embed, wait=True)
+        message_cache.put(signup_message)
         await signup_message.add_reaction("✅")
         
         # 創建職業選擇訊息
@@ -2075,150 +3754,22 @@ async def create_event_slash(
         for emoji in ["🛡️", "⚔️", "💚", "💛"]:
             await class_msg.add_reaction(emoji)
         
-        signup_end_time = datetime.now() + timedelta(minutes=signup_time)
-        
         # 儲存活動到資料庫
-        async with aiosqlite.connect(DB_NAME) as conn:
-            await conn.execute('''
-                INSERT INTO evaluation_events (event_name, creator_id, signup_message_id, profession_message_id, channel_id, signup_end_time, guild_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (event_name, interaction.user.id, signup_message.id, class_msg.id, interaction.channel.id, signup_end_time, guild_id))
+        async with db_pool.writer() as conn:
+            cursor = await conn.execute('''
+                INSERT INTO evaluation_events (event_name, creator_id, signup_message_id, profession_message_id, channel_id, signup_end_time, guild_id, prize)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (event_name, interaction.user.id, signup_message.id, class_msg.id, interaction.channel.id, signup_end_time, guild_id, prize))
+            event_id = cursor.lastrowid
             await conn.commit()
         
-        print(f"✅ 活動創建成功: {event_name}, 簽到訊息ID: {signup_message.id}, 職業訊息ID: {class_msg.id}")
+        message_router.register(signup_message.id, "signup", event_id, guild_id)
+        message_router.register(class_msg.id, "profession", event_id, guild_id)
         
-        # 簽到倒計時
-        async def signup_countdown():
-            remaining_minutes = signup_time
-            
-            while remaining_minutes > 0:
-                await asyncio.sleep(60)
-                remaining_minutes -= 1
-                
-                try:
-                    async with aiosqlite.connect(DB_NAME) as conn:
-                        async with conn.execute("SELECT participants FROM evaluation_events WHERE signup_message_id = ? AND guild_id = ?", (signup_message.id, guild_id)) as cursor:
-                            result = await cursor.fetchone()
-                        
-                        participants_count = 0
-                        if result and result[0]:
-                            participants = json.loads(result[0])
-                            participants_count = len(participants)
-                    
-                    updated_embed = discord.Embed(
-                        title=f"📋 評核活動：{event_name}",
-                        color=discord.Color.blue()
-                    )
-                    
-                    if prize:
-                        updated_embed.add_field(name="🎁 獎品", value=prize, inline=False)
-                    
-                    updated_embed.add_field(
-                        name="📝 簽到階段",
-                        value=f"請在活動開始後 {signup_time} 分鐘內按 ✅ 簽到\n超過時間簽到將不計算出席率",
-                        inline=False
-                    )
-                    
-                    updated_embed.add_field(name="⏰ 簽到時間", value=f"{signup_time} 分鐘", inline=True)
-                    updated_embed.add_field(name="👥 已簽到", value=f"{participants_count} 人", inline=True)
-                    updated_embed.add_field(name="⏱️ 剩餘時間", value=f"{remaining_minutes} 分鐘", inline=True)
-                    updated_embed.set_footer(text=f"半月期: {get_current_half_month()}")
-                    
-                    await signup_message.edit(embed=updated_embed)
-                    
-                except Exception as e:
-                    print(f"更新簽到訊息錯誤: {e}")
-            
-            # 簽到時間結束，處理簽到結果
-            try:
-                async with aiosqlite.connect(DB_NAME) as conn:
-                    async with conn.execute("SELECT participants FROM evaluation_events WHERE signup_message_id = ? AND guild_id = ?", (signup_message.id, guild_id)) as cursor:
-                        result = await cursor.fetchone()
-                    
-                    participants = []
-                    if result and result[0]:
-                        participants = json.loads(result[0])
-                    
-                    # 為所有參與者發放簽到獎勵
-                    for user_id in participants:
-                        await update_user_score(user_id, f"用戶{user_id}", SIGNUP_SCORE, f"活動簽到: {event_name}", guild_id)
-                        await update_user_activity(user_id, event_name, attended=True, guild_id=guild_id)
-                        await update_user_rating(user_id, "普通", guild_id)
-                    
-                    # 更新活動狀態
-                    await conn.execute("UPDATE evaluation_events SET default_rated = ?, is_active = 1 WHERE signup_message_id = ? AND guild_id = ?", 
-                                     (json.dumps(participants), signup_message.id, guild_id))
-                    await conn.commit()
-                
-                # 更新簽到訊息
-                end_embed = discord.Embed(
-                    title=f"📋 評核活動：{event_name}",
-                    description="**簽到已結束！所有參與者已獲得預設「普通」評級（0積分）**",
-                    color=discord.Color.red()
-                )
-                
-                if prize:
-                    end_embed.add_field(name="🎁 獎品", value=prize, inline=False)
-                
-                end_embed.add_field(name="⏰ 簽到時間", value="已結束", inline=True)
-                end_embed.add_field(name="👥 已簽到", value=f"{len(participants)} 人", inline=True)
-                
-                if participants:
-                    participants_text = "\n".join([f"<@{user_id}>" for user_id in participants[:10]])
-                    if len(participants) > 10:
-                        participants_text += f"\n... 還有 {len(participants) - 10} 人"
-                    
-                    end_embed.add_field(name="📋 參與者列表", value=participants_text, inline=False)
-                
-                end_embed.add_field(name="📝 評核說明", value="主持人現在可以按EMOJI調整評級：\n⭐ 優秀 (+40分)\n👍 良好 (+10分)\n👌 普通 (0分，預設)\n❌ 不合格 (-5分)", inline=False)
-                end_embed.set_footer(text="半月期活動統計已更新 | 簽到積分已發放 | 預設評級：普通")
-                
-                await signup_message.edit(embed=end_embed)
-                await signup_message.clear_reactions()
-                
-                print(f"✅ 簽到結束: {event_name}, 參與者: {len(participants)}人, 已給予預設普通評級")
-                
-                # 創建評核階段訊息
-                rating_embed = discord.Embed(
-                    title=f"⭐ 評核階段：{event_name}",
-                    description="**主持人可以按下方EMOJI調整評級**\n\n"
-                              f"所有參與者已獲得預設「普通」評級（{RATING_SCORES['普通']}積分）\n"
-                              f"請主持人針對表現優秀或需要改進的成員調整評級：\n\n"
-                              f"⭐ 優秀：+{RATING_SCORES['優秀']}積分\n"
-                              f"👍 良好：+{RATING_SCORES['良好']}積分\n"
-                              f"👌 普通：{RATING_SCORES['普通']}積分（預設）\n"
-                              f"❌ 不合格：{RATING_SCORES['不合格']}積分\n\n"
-                              f"**使用方法：**\n1. 點擊下方對應的EMOJI\n2. 在彈出的視窗中選擇用戶\n3. 系統會自動更新評級",
-                    color=discord.Color.gold()
-                )
-                
-                if participants:
-                    rating_embed.add_field(
-                        name="👥 參與者列表",
-                        value="\n".join([f"<@{user_id}>" for user_id in participants[:15]]) + 
-                             (f"\n... 還有 {len(participants)-15} 人" if len(participants) > 15 else ""),
-                        inline=False
-                    )
-                
-                rating_msg = await interaction.channel.send(embed=rating_embed)
-                
-                # 添加評核反應
-                for emoji in ["⭐", "👍", "👌", "❌", RATING_END_EMOJI]:
-                    await rating_msg.add_reaction(emoji)
-                
-                # 儲存評核訊息ID
-                async with aiosqlite.connect(DB_NAME) as conn:
-                    await conn.execute("UPDATE evaluation_events SET rating_message_id = ? WHERE signup_message_id = ? AND guild_id = ?", 
-                                     (rating_msg.id, signup_message.id, guild_id))
-                    await conn.commit()
-                
-                print(f"✅ 評核階段已創建: {event_name}, 評核訊息ID: {rating_msg.id}")
-                
-            except Exception as e:
-                print(f"簽到結束處理錯誤: {e}")
+        print(f"✅ 活動創建成功: {event_name}, 簽到訊息ID: {signup_message.id}, 職業訊息ID: {class_msg.id}")
         
         # 啟動簽到倒計時
-        asyncio.create_task(signup_countdown())
+        arm_signup_timers(event_id, signup_deadline)
         
         # 發送創建成功訊息
         success_embed = discord.Embed(
@@ -2253,47 +3804,44 @@ async def activity_stats_slash(interaction: discord.Interaction):
         guild_id = get_guild_id(interaction)
         await log_query("activity_stats", interaction.user.id, {"action": "view_stats"}, guild_id)
         
-        async with aiosqlite.connect(DB_NAME) as conn:
-            # 獲取活動統計
-            async with conn.execute("SELECT COUNT(*) FROM evaluation_events WHERE guild_id = ?", (guild_id,)) as cursor:
-                total_events = (await cursor.fetchone())[0]
-            
-            async with conn.execute("SELECT COUNT(*) FROM evaluation_events WHERE guild_id = ? AND is_active = 1", (guild_id,)) as cursor:
-                active_events = (await cursor.fetchone())[0]
-            
-            async with conn.execute("SELECT COUNT(*) FROM giveaways WHERE guild_id = ?", (guild_id,)) as cursor:
-                total_giveaways = (await cursor.fetchone())[0]
-            
-            async with conn.execute("SELECT COUNT(*) FROM giveaways WHERE guild_id = ? AND is_active = 1", (guild_id,)) as cursor:
-                active_giveaways = (await cursor.fetchone())[0]
-            
-            # 獲取用戶統計
-            async with conn.execute("SELECT COUNT(*) FROM users WHERE guild_id = ?", (guild_id,)) as cursor:
-                total_users = (await cursor.fetchone())[0]
-            
-            async with conn.execute("SELECT SUM(current_score), SUM(total_score) FROM users WHERE guild_id = ?", (guild_id,)) as cursor:
-                score_result = await cursor.fetchone()
-                total_current_score = score_result[0] or 0
-                total_earned_score = score_result[1] or 0
+        async with db_pool.reader() as conn:
+            # 活動與抽獎計數：單一聚合查詢，皆由覆蓋索引完成
+            async with conn.execute("""
+                SELECT e.total, e.active, COALESCE(p.event_count, 0), g.total, g.active
+                FROM (
+                    SELECT COUNT(*) AS total, COALESCE(SUM(is_active = 1), 0) AS active
+                    FROM evaluation_events WHERE guild_id = ?
+                ) e
+                CROSS JOIN (
+                    SELECT COUNT(*) AS total, COALESCE(SUM(is_active = 1), 0) AS active
+                    FROM giveaways WHERE guild_id = ?
+                ) g
+                LEFT JOIN period_events p ON p.guild_id = ? AND p.period_id = ?
+            """, (guild_id, guild_id, guild_id, get_current_half_month())) as cursor:
+                total_events, active_events, period_events, total_giveaways, active_giveaways = await cursor.fetchone()
             
-            # 獲取最近活動
+            # 獲取最近活動（參與人數由 event_participants 主鍵索引計數）
             async with conn.execute("""
-                SELECT event_name, COUNT(*) as participant_count, start_time 
-                FROM evaluation_events 
-                WHERE guild_id = ? 
-                GROUP BY event_name 
-                ORDER BY start_time DESC 
+                SELECT e.event_name,
+                       (SELECT COUNT(*) FROM event_participants p WHERE p.event_id = e.id) AS participant_count,
+                       e.start_time 
+                FROM evaluation_events e
+                WHERE e.guild_id = ? 
+                ORDER BY e.start_time DESC 
                 LIMIT 5
             """, (guild_id,)) as cursor:
                 recent_events = await cursor.fetchall()
         
+        # 用戶統計由積分排行榜維護的總和直接取得
+        total_users, total_current_score, total_earned_score = score_board.summary(guild_id)
+        
         embed = discord.Embed(
             title="📊 活動統計數據",
             description=f"伺服器：{interaction.guild.name if interaction.guild else 'DM'}",
             color=0x7289DA
         )
         
-        embed.add_field(name="🎮 評核活動", value=f"總數：{total_events}\n進行中：{active_events}", inline=True)
+        embed.add_field(name="🎮 評核活動", value=f"總數：{total_events}\n進行中：{active_events}\n本半月期：{period_events}", inline=True)
         embed.add_field(name="🎉 抽獎活動", value=f"總數：{total_giveaways}\n進行中：{active_giveaways}", inline=True)
         embed.add_field(name="👥 用戶統計", value=f"總用戶數：{total_users}\n總積分：{total_current_score}", inline=True)
         
@@ -2339,9 +3887,6 @@ async def on_ready():
     print(f"📊 伺服器數量: {len(bot.guilds)}")
     print(f"{'='*60}")
     
-    await init_db()
-    print("✅ 資料庫初始化完成")
-    
     try:
         print("\n🔄 正在同步指令...")
         global_synced = await tree.sync()
@@ -2372,190 +3917,165 @@ async def on_raw_reaction_add(payload):
     try:
         emoji = str(payload.emoji)
         user_id = payload.user_id
+        guild_id = payload.guild_id if hasattr(payload, 'guild_id') else 0
         
-        channel = bot.get_channel(payload.channel_id)
-        if not channel:
+        # 不是機器人管理的訊息：不查資料庫也不呼叫 Discord API
+        route = message_router.get(payload.message_id)
+        if not route or route[2] != guild_id:
             return
         
-        try:
-            message = await channel.fetch_message(payload.message_id)
-        except:
+        kind, target_id, _ = route
+        
+        channel = bot.get_channel(payload.channel_id)
+        if not channel:
             return
         
-        guild_id = payload.guild_id if hasattr(payload, 'guild_id') else 0
+        # 只建立 PartialMessage（不呼叫 API），需要讀取 embed 時才透過快取取得完整訊息
+        message = channel.get_partial_message(payload.message_id)
         
-        async with aiosqlite.connect(DB_NAME) as conn:
-            # 檢查是否是評核活動的評核訊息
-            async with conn.execute("""
-                SELECT id, channel_id, event_name 
-                FROM evaluation_events 
-                WHERE rating_message_id = ? AND is_active = 1 AND guild_id = ?
-            """, (payload.message_id, guild_id)) as cursor:
-                rating_event = await cursor.fetchone()
+        # 檢查是否是評核活動的評核訊息
+        rating_event = None
+        if kind == "rating":
+            async with db_pool.reader() as conn:
+                async with conn.execute("""
+                    SELECT id, channel_id, event_name 
+                    FROM evaluation_events 
+                    WHERE id = ? AND is_active = 1 AND guild_id = ?
+                """, (target_id, guild_id)) as cursor:
+                    rating_event = await cursor.fetchone()
+        
+        if rating_event and emoji == RATING_END_EMOJI:
+            event_id, event_channel_id, event_name = rating_event
             
-            if rating_event and emoji == RATING_END_EMOJI:
-                event_id, event_channel_id, event_name = rating_event
-                
-                try:
-                    guild = channel.guild
-                    member = await guild.fetch_member(user_id)
-                    if not member.guild_permissions.administrator:
-                        try:
-                            await message.remove_reaction(emoji, member)
-                            await channel.send(f"❌ <@{user_id}> 只有管理員可以結束評核活動！", delete_after=5)
-                        except:
-                            pass
-                        return
-                except Exception as admin_error:
-                    print(f"檢查管理員權限錯誤: {admin_error}")
+            try:
+                if not await permission_resolver.is_admin(channel.guild, user_id, payload.member):
+                    try:
+                        await message.remove_reaction(emoji, discord.Object(id=user_id))
+                        await channel.send(f"❌ <@{user_id}> 只有管理員可以結束評核活動！", delete_after=5)
+                    except:
+                        pass
                     return
+            except Exception as admin_error:
+                print(f"檢查管理員權限錯誤: {admin_error}")
+                return
+            
+            confirm_embed = discord.Embed(
+                title="🏁 確認結束評核活動",
+                description=f"你確定要結束 **{event_name}** 的評核階段嗎？\n\n"
+                          f"結束後將：\n"
+                          f"• 無法再進行評核\n"
+                          f"• 清除評核訊息的所有反應\n"
+                          f"• 活動標記為已完成",
+                color=discord.Color.orange()
+            )
+            
+            class ConfirmEndView(discord.ui.View):
+                def __init__(self, event_id, channel, event_name, guild_id):
+                    super().__init__(timeout=60)
+                    self.event_id = event_id
+                    self.channel = channel
+                    self.event_name = event_name
+                    self.guild_id = guild_id
                 
-                confirm_embed = discord.Embed(
-                    title="🏁 確認結束評核活動",
-                    description=f"你確定要結束 **{event_name}** 的評核階段嗎？\n\n"
-                              f"結束後將：\n"
-                              f"• 無法再進行評核\n"
-                              f"• 清除評核訊息的所有反應\n"
-                              f"• 活動標記為已完成",
-                    color=discord.Color.orange()
-                )
+                @discord.ui.button(label="確定結束", style=discord.ButtonStyle.danger, emoji="✅")
+                async def confirm(self, interaction: discord.Interaction, button: discord.ui.Button):
+                    if not interaction.user.guild_permissions.administrator:
+                        await interaction.response.send_message("❌ 需要管理員權限", ephemeral=True)
+                        return
+                    
+                    await interaction.response.defer()
+                    
+                    await end_evaluation(self.event_id, self.channel, self.event_name, self.guild_id)
+                    
+                    for child in self.children:
+                        child.disabled = True
+                    await interaction.message.edit(view=self)
+                    
+                    await interaction.followup.send(f"✅ 已成功結束 **{self.event_name}** 的評核階段！")
                 
-                class ConfirmEndView(discord.ui.View):
-                    def __init__(self, event_id, channel, event_name, guild_id):
-                        super().__init__(timeout=60)
-                        self.event_id = event_id
-                        self.channel = channel
-                        self.event_name = event_name
-                        self.guild_id = guild_id
+                @discord.ui.button(label="取消", style=discord.ButtonStyle.secondary, emoji="❌")
+                async def cancel(self, interaction: discord.Interaction, button: discord.ui.Button):
+                    if not interaction.user.guild_permissions.administrator:
+                        await interaction.response.send_message("❌ 需要管理員權限", ephemeral=True)
+                        return
                     
-                    @discord.ui.button(label="確定結束", style=discord.ButtonStyle.danger, emoji="✅")
-                    async def confirm(self, interaction: discord.Interaction, button: discord.ui.Button):
-                        if not interaction.user.guild_permissions.administrator:
-                            await interaction.response.send_message("❌ 需要管理員權限", ephemeral=True)
-                            return
-                        
-                        await interaction.response.defer()
-                        
-                        await end_evaluation(self.event_id, self.channel, self.event_name, self.guild_id)
-                        
-                        for child in self.children:
-                            child.disabled = True
-                        await interaction.message.edit(view=self)
-                        
-                        await interaction.followup.send(f"✅ 已成功結束 **{self.event_name}** 的評核階段！")
+                    await interaction.response.send_message("已取消結束評核活動", ephemeral=True)
+                    
+                    for child in self.children:
+                        child.disabled = True
+                    await interaction.message.edit(view=self)
+            
+            view = ConfirmEndView(event_id, channel, event_name, guild_id)
+            await channel.send(f"<@{user_id}>", embed=confirm_embed, view=view)
+            return
+        
+        # 檢查是否是評核活動的評核反應
+        if rating_event and emoji in RATING_EMOJIS:
+            event_id, event_channel_id, event_name = rating_event
+            rating_type = RATING_EMOJIS[emoji]
+            
+            print(f"檢測到評核反應: event_id={event_id}, rating_type={rating_type}, user_id={user_id}")
+            
+            try:
+                if not await permission_resolver.is_admin(channel.guild, user_id, payload.member):
+                    try:
+                        await message.remove_reaction(emoji, discord.Object(id=user_id))
+                        await channel.send(f"❌ <@{user_id}> 只有管理員可以進行評核！", delete_after=5)
+                    except:
+                        pass
+                    return
+            except Exception as admin_error:
+                print(f"檢查管理員權限錯誤: {admin_error}")
+                return
+            
+            participants = await get_event_participants(event_id)
+            
+            if not participants:
+                await channel.send("❌ 沒有參與者可以評核", delete_after=5)
+                return
+            
+            print(f"活動 {event_name} 有 {len(participants)} 位參與者可以評核")
+            
+            class ParticipantSelectView(discord.ui.View):
+                def __init__(self, participants, event_id, rating_type, channel, bot_instance, guild_id):
+                    super().__init__(timeout=60)
+                    self.participants = participants
+                    self.event_id = event_id
+                    self.rating_type = rating_type
+                    self.channel = channel
+                    self.bot = bot_instance
+                    self.guild_id = guild_id
+                    
+                    options = []
+                    for pid in participants[:25]:
+                        member = self.bot.get_user(int(pid))
+                        display_name = member.display_name if member else f"用戶ID: {pid}"
+                        options.append(discord.SelectOption(
+                            label=display_name[:100],
+                            value=str(pid),
+                            description=f"點擊選擇此用戶進行 {rating_type} 評核"
+                        ))
+                    
+                    select = discord.ui.Select(
+                        placeholder=f"選擇要評核為 {rating_type} 的參與者",
+                        options=options,
+                        min_values=1,
+                        max_values=1
+                    )
                     
-                    @discord.ui.button(label="取消", style=discord.ButtonStyle.secondary, emoji="❌")
-                    async def cancel(self, interaction: discord.Interaction, button: discord.ui.Button):
+                    async def select_callback(interaction: discord.Interaction):
                         if not interaction.user.guild_permissions.administrator:
                             await interaction.response.send_message("❌ 需要管理員權限", ephemeral=True)
                             return
                         
-                        await interaction.response.send_message("已取消結束評核活動", ephemeral=True)
-                        
-                        for child in self.children:
-                            child.disabled = True
-                        await interaction.message.edit(view=self)
-                
-                view = ConfirmEndView(event_id, channel, event_name, guild_id)
-                await channel.send(f"<@{user_id}>", embed=confirm_embed, view=view)
-                return
-            
-            # 檢查是否是評核活動的評核反應
-            if rating_event and emoji in RATING_EMOJIS:
-                event_id, event_channel_id, event_name = rating_event
-                rating_type = RATING_EMOJIS[emoji]
-                
-                print(f"檢測到評核反應: event_id={event_id}, rating_type={rating_type}, user_id={user_id}")
-                
-                try:
-                    guild = channel.guild
-                    member = await guild.fetch_member(user_id)
-                    if not member.guild_permissions.administrator:
-                        try:
-                            await message.remove_reaction(emoji, member)
-                            await channel.send(f"❌ <@{user_id}> 只有管理員可以進行評核！", delete_after=5)
-                        except:
-                            pass
-                        return
-                except Exception as admin_error:
-                    print(f"檢查管理員權限錯誤: {admin_error}")
-                    return
-                
-                async with conn.execute("SELECT participants FROM evaluation_events WHERE id = ? AND guild_id = ?", (event_id, guild_id)) as cursor:
-                    result = await cursor.fetchone()
-                
-                participants = []
-                if result and result[0]:
-                    participants = json.loads(result[0])
-                
-                if not participants:
-                    await channel.send("❌ 沒有參與者可以評核", delete_after=5)
-                    return
-                
-                print(f"活動 {event_name} 有 {len(participants)} 位參與者可以評核")
-                
-                class ParticipantSelectView(discord.ui.View):
-                    def __init__(self, participants, event_id, rating_type, channel, bot_instance, guild_id):
-                        super().__init__(timeout=60)
-                        self.participants = participants
-                        self.event_id = event_id
-                        self.rating_type = rating_type
-                        self.channel = channel
-                        self.bot = bot_instance
-                        self.guild_id = guild_id
-                        
-                        options = []
-                        for pid in participants[:25]:
-                            member = self.bot.get_user(int(pid))
-                            display_name = member.display_name if member else f"用戶ID: {pid}"
-                            options.append(discord.SelectOption(
-                                label=display_name[:100],
-                                value=str(pid),
-                                description=f"點擊選擇此用戶進行 {rating_type} 評核"
-                            ))
+                        selected_user_id = int(select.values[0])
+                        selected_member = self.bot.get_user(selected_user_id)
+                        display_name = selected_member.display_name if selected_member else f"用戶ID: {selected_user_id}"
                         
-                        select = discord.ui.Select(
-                            placeholder=f"選擇要評核為 {rating_type} 的參與者",
-                            options=options,
-                            min_values=1,
-                            max_values=1
-                        )
+                        print(f"選擇了用戶 {display_name} ({selected_user_id}) 進行 {rating_type} 評核")
                         
-                        async def select_callback(interaction: discord.Interaction):
-                            if not interaction.user.guild_permissions.administrator:
-                                await interaction.response.send_message("❌ 需要管理員權限", ephemeral=True)
-                                return
-                            
-                            selected_user_id = int(select.values[0])
-                            selected_member = self.bot.get_user(selected_user_id)
-                            display_name = selected_member.display_name if selected_member else f"用戶ID: {selected_user_id}"
-                            
-                            print(f"選擇了用戶 {display_name} ({selected_user_id}) 進行 {rating_type} 評核")
-                            
-                            async with aiosqlite.connect(DB_NAME) as conn:
-                                async with conn.execute("SELECT ratings FROM evaluation_events WHERE id = ? AND guild_id = ?", (self.event_id, self.guild_id)) as cursor:
-                                    result = await cursor.fetchone()
-                                
-                                ratings = {}
-                                if result and result[0]:
-                                    ratings = json.loads(result[0])
-                                
-                                old_rating = None
-                                if str(selected_user_id) in ratings and ratings[str(selected_user_id)]:
-                                    old_rating = ratings[str(selected_user_id)][-1]["rating"] if ratings[str(selected_user_id)] else None
-                                
-                                if str(selected_user_id) not in ratings:
-                                    ratings[str(selected_user_id)] = []
-                                
-                                ratings[str(selected_user_id)].append({
-                                    "rater": interaction.user.id,
-                                    "rating": self.rating_type,
-                                    "time": datetime.now().isoformat()
-                                })
-                                
-                                await conn.execute("UPDATE evaluation_events SET ratings = ? WHERE id = ? AND guild_id = ?", 
-                                                 (json.dumps(ratings), self.event_id, self.guild_id))
-                                await conn.commit()
+                        async def apply_rating():
+                            old_rating = await record_evaluation_rating(self.event_id, selected_user_id, interaction.user.id, self.rating_type)
                             
                             if old_rating and old_rating != self.rating_type:
                                 old_score = RATING_SCORES.get(old_rating, 0)
@@ -2569,237 +4089,174 @@ async def on_raw_reaction_add(payload):
                                 await update_user_score(selected_user_id, display_name, new_score, f"活動評核: {self.rating_type}", self.guild_id)
                                 print(f"添加新評級積分: {self.rating_type} (+{new_score}分)")
                             
-                            score_change = RATING_SCORES.get(self.rating_type, 0)
-                            score_text = f"（積分變動: {'+' if score_change > 0 else ''}{score_change}分）" if score_change != 0 else ""
-                            
-                            if old_rating and old_rating != self.rating_type:
-                                old_score = RATING_SCORES.get(old_rating, 0)
-                                result_text = f"已將 <@{selected_user_id}> ({display_name}) 的評級從 **{old_rating}** ({old_score}分) 變更為 **{self.rating_type}** {score_text}"
-                            else:
-                                result_text = f"已為 <@{selected_user_id}> ({display_name}) 評核：**{self.rating_type}** {score_text}"
-                            
-                            result_embed = discord.Embed(
-                                title="✅ 評核完成",
-                                description=result_text,
-                                color=discord.Color.green() if score_change >= 0 else discord.Color.red()
-                            )
-                            
-                            result_embed.add_field(name="評核者", value=interaction.user.mention, inline=True)
-                            result_embed.add_field(name="新評級", value=self.rating_type, inline=True)
-                            result_embed.add_field(name="積分變動", value=f"{score_change} 分", inline=True)
-                            
-                            await interaction.response.send_message(embed=result_embed)
-                            
-                            for child in self.children:
-                                child.disabled = True
-                            await interaction.message.edit(view=self)
+                            return old_rating
                         
-                        select.callback = select_callback
-                        self.add_item(select)
-                
-                view = ParticipantSelectView(participants, event_id, rating_type, channel, bot, guild_id)
-                
-                select_message = await channel.send(f"<@{user_id}> 請選擇要評核為 **{rating_type}** 的參與者：", view=view)
-                print(f"已發送選擇視窗: message_id={select_message.id}")
-                return
+                        # 同一活動的評核依序處理，避免同時評核同一人時重複扣分
+                        old_rating = await state_actors.event(self.event_id, self.guild_id).call(apply_rating)
+                        
+                        score_change = RATING_SCORES.get(self.rating_type, 0)
+                        score_text = f"（積分變動: {'+' if score_change > 0 else ''}{score_change}分）" if score_change != 0 else ""
+                        
+                        if old_rating and old_rating != self.rating_type:
+                            old_score = RATING_SCORES.get(old_rating, 0)
+                            result_text = f"已將 <@{selected_user_id}> ({display_name}) 的評級從 **{old_rating}** ({old_score}分) 變更為 **{self.rating_type}** {score_text}"
+                        else:
+                            result_text = f"已為 <@{selected_user_id}> ({display_name}) 評核：**{self.rating_type}** {score_text}"
+                        
+                        result_embed = discord.Embed(
+                            title="✅ 評核完成",
+                            description=result_text,
+                            color=discord.Color.green() if score_change >= 0 else discord.Color.red()
+                        )
+                        
+                        result_embed.add_field(name="評核者", value=interaction.user.mention, inline=True)
+                        result_embed.add_field(name="新評級", value=self.rating_type, inline=True)
+                        result_embed.add_field(name="積分變動", value=f"{score_change} 分", inline=True)
+                        
+                        await interaction.response.send_message(embed=result_embed)
+                        
+                        for child in self.children:
+                            child.disabled = True
+                        await interaction.message.edit(view=self)
+                    
+                    select.callback = select_callback
+                    self.add_item(select)
             
-            # 檢查是否是抽獎
-            async with conn.execute("""
-                SELECT id, participants, creator_id 
-                FROM giveaways 
-                WHERE message_id = ? AND is_active = 1 AND guild_id = ?
-            """, (payload.message_id, guild_id)) as cursor:
-                giveaway = await cursor.fetchone()
+            view = ParticipantSelectView(participants, event_id, rating_type, channel, bot, guild_id)
             
-            if giveaway:
-                giveaway_id, participants_json, creator_id = giveaway
-                
-                if emoji == "🎫":
-                    participants = json.loads(participants_json) if participants_json else []
-                    
-                    if user_id not in participants:
-                        participants.append(user_id)
-                        await conn.execute("UPDATE giveaways SET participants = ? WHERE id = ? AND guild_id = ?", 
-                                         (json.dumps(participants), giveaway_id, guild_id))
-                        await conn.commit()
-                        
-                        try:
-                            if message.embeds:
-                                embed = message.embeds[0]
-                                
-                                new_embed = discord.Embed(
-                                    title=embed.title,
-                                    description=embed.description,
-                                    color=embed.color
-                                )
-                                
-                                for field in embed.fields:
-                                    if field.name == "🎫 參與人數":
-                                        new_embed.add_field(
-                                            name="🎫 參與人數", 
-                                            value=f"{len(participants)} 人", 
-                                            inline=field.inline
-                                        )
-                                    else:
-                                        new_embed.add_field(
-                                            name=field.name, 
-                                            value=field.value, 
-                                            inline=field.inline
-                                        )
-                                
-                                if embed.footer:
-                                    new_embed.set_footer(text=embed.footer.text)
-                                
-                                await message.edit(embed=new_embed)
-                        except Exception as e:
-                            print(f"更新抽獎訊息錯誤: {e}")
+            select_message = await channel.send(f"<@{user_id}> 請選擇要評核為 **{rating_type}** 的參與者：", view=view)
+            print(f"已發送選擇視窗: message_id={select_message.id}")
+            return
+        
+        # 檢查是否是抽獎
+        giveaway = None
+        if kind == "giveaway":
+            async with db_pool.reader() as conn:
+                async with conn.execute("""
+                    SELECT id, creator_id 
+                    FROM giveaways 
+                    WHERE id = ? AND is_active = 1 AND guild_id = ?
+                """, (target_id, guild_id)) as cursor:
+                    giveaway = await cursor.fetchone()
+        
+        if giveaway:
+            giveaway_id, creator_id = giveaway
+            
+            if emoji == "🎫":
+                joined, entry_count = await state_actors.giveaway(giveaway_id).enter(user_id)
                 
-                elif emoji == "⏹️" and user_id == creator_id:
-                    await end_giveaway(payload.message_id, manual=True, guild_id=guild_id)
-                    await channel.send(f"⏹️ 主辦人手動結束了抽獎！")
-                return
+                if joined:
+                    try:
+                        # 以尚未送出的最新 embed 為基礎，避免覆蓋排隊中的更新
+                        embed = await current_embed(message)
+                        if embed is not None:
+                            embed_editor.request(message, rebuild_embed(embed, {"🎫 參與人數": f"{entry_count} 人"}))
+                    except Exception as e:
+                        print(f"更新抽獎訊息錯誤: {e}")
             
-            # 檢查是否是活動簽到
-            async with conn.execute("""
-                SELECT id, participants, signup_end_time 
-                FROM evaluation_events 
-                WHERE signup_message_id = ? AND is_active = 1 AND guild_id = ?
-            """, (payload.message_id, guild_id)) as cursor:
-                signup_event = await cursor.fetchone()
+            elif emoji == "⏹️" and user_id == creator_id:
+                await end_giveaway(payload.message_id, manual=True, guild_id=guild_id)
+                await channel.send(f"⏹️ 主辦人手動結束了抽獎！")
+            return
+        
+        # 檢查是否是活動簽到
+        signup_event = None
+        if kind == "signup":
+            async with db_pool.reader() as conn:
+                async with conn.execute("""
+                    SELECT id, signup_end_time 
+                    FROM evaluation_events 
+                    WHERE id = ? AND is_active = 1 AND guild_id = ?
+                """, (target_id, guild_id)) as cursor:
+                    signup_event = await cursor.fetchone()
+        
+        if signup_event and emoji == "✅":
+            event_id, signup_end_time_str = signup_event
             
-            if signup_event and emoji == "✅":
-                event_id, participants_json, signup_end_time_str = signup_event
-                
-                try:
-                    if signup_end_time_str:
-                        try:
-                            signup_end_time = datetime.strptime(signup_end_time_str.split('.')[0], '%Y-%m-%d %H:%M:%S')
-                        except:
-                            try:
-                                signup_end_time = datetime.strptime(signup_end_time_str, '%Y-%m-%d %H:%M:%S.%f')
-                            except:
-                                signup_end_time = None
-                    else:
-                        signup_end_time = None
-                    
-                    if signup_end_time and datetime.now() > signup_end_time:
+            try:
+                if signup_end_time_str:
+                    try:
+                        signup_end_time = datetime.strptime(signup_end_time_str.split('.')[0], '%Y-%m-%d %H:%M:%S')
+                    except:
                         try:
-                            await message.remove_reaction("✅", payload.member)
-                            await channel.send(f"❌ <@{user_id}> 簽到時間已過！", delete_after=5)
+                            signup_end_time = datetime.strptime(signup_end_time_str, '%Y-%m-%d %H:%M:%S.%f')
                         except:
-                            pass
-                        return
-                except Exception as time_error:
-                    print(f"時間解析錯誤: {time_error}")
-                
-                participants = json.loads(participants_json) if participants_json else []
+                            signup_end_time = None
+                else:
+                    signup_end_time = None
                 
-                # 修復：檢查用戶是否已經簽到
-                if user_id not in participants:
-                    participants.append(user_id)
-                    
-                    # 更新資料庫中的參與者列表
-                    await conn.execute("UPDATE evaluation_events SET participants = ? WHERE id = ? AND guild_id = ?", 
-                                     (json.dumps(participants), event_id, guild_id))
-                    await conn.commit()
-                    
-                    print(f"✅ 用戶 {user_id} 成功簽到活動 {event_id}, 現在有 {len(participants)} 人簽到")
-                    
-                    # 更新訊息顯示
+                if signup_end_time and datetime.now() > signup_end_time:
                     try:
-                        if message.embeds:
-                            embed = message.embeds[0]
-                            
-                            new_embed = discord.Embed(
-                                title=embed.title,
-                                description=embed.description,
-                                color=embed.color
-                            )
-                            
-                            for field in embed.fields:
-                                if field.name == "👥 已簽到":
-                                    new_embed.add_field(
-                                        name="👥 已簽到", 
-                                        value=f"{len(participants)} 人", 
-                                        inline=field.inline
-                                    )
-                                elif field.name == "⏱️ 剩餘時間":
-                                    new_embed.add_field(
-                                        name=field.name,
-                                        value=field.value,
-                                        inline=field.inline
-                                    )
-                                else:
-                                    new_embed.add_field(
-                                        name=field.name, 
-                                        value=field.value, 
-                                        inline=field.inline
-                                    )
-                            
-                            if embed.footer:
-                                new_embed.set_footer(text=embed.footer.text)
-                            
-                            await message.edit(embed=new_embed)
-                    except Exception as e:
-                        print(f"更新簽到訊息錯誤: {e}")
-                else:
-                    print(f"⚠️ 用戶 {user_id} 已經簽到過了")
-                return
+                        await message.remove_reaction("✅", payload.member)
+                        await channel.send(f"❌ <@{user_id}> 簽到時間已過！", delete_after=5)
+                    except:
+                        pass
+                    return
+            except Exception as time_error:
+                print(f"時間解析錯誤: {time_error}")
             
-            # 檢查是否是職業選擇
-            async with conn.execute("""
-                SELECT id, professions 
-                FROM evaluation_events 
-                WHERE profession_message_id = ? AND is_active = 1 AND guild_id = ?
-            """, (payload.message_id, guild_id)) as cursor:
-                profession_event = await cursor.fetchone()
+            # 由活動 actor 依序處理簽到，重複簽到不會寫入；人數顯示於批次寫入後更新
+            signed, participants_count = await state_actors.event(event_id, guild_id).signup(user_id, message)
+            if signed:
+                print(f"✅ 用戶 {user_id} 成功簽到活動 {event_id}, 現在有 {participants_count} 人簽到")
+            else:
+                print(f"⚠️ 用戶 {user_id} 已經簽到過了")
+            return
+        
+        # 檢查是否是職業選擇
+        if kind == "profession" and emoji in PROFESSION_EMOJIS:
+            event_id = target_id
+            profession_name = PROFESSION_EMOJIS[emoji]
             
-            if profession_event and emoji in PROFESSION_EMOJIS:
-                event_id, professions_json = profession_event
-                profession_name = PROFESSION_EMOJIS[emoji]
-                
-                async with conn.execute("SELECT participants FROM evaluation_events WHERE id = ? AND guild_id = ?", (event_id, guild_id)) as cursor:
-                    result = await cursor.fetchone()
-                
-                if result and result[0]:
-                    participants = json.loads(result[0])
-                    
-                    if user_id in participants:
-                        professions = json.loads(professions_json) if professions_json else {}
-                        
-                        if str(user_id) not in professions:
-                            professions[str(user_id)] = profession_name
-                            await conn.execute("UPDATE evaluation_events SET professions = ? WHERE id = ? AND guild_id = ?", 
-                                             (json.dumps(professions), event_id, guild_id))
-                            await conn.commit()
-                            
-                            await update_user_profession(user_id, profession_name, guild_id)
-                            
-                            try:
-                                bonus = PROFESSION_BONUS.get(profession_name, 0)
-                                bonus_text = f"（獲得職業加成：+{bonus}積分）" if bonus > 0 else ""
-                                await channel.send(f"✅ <@{user_id}> 已選擇職業：**{profession_name}**{bonus_text}", delete_after=5)
-                            except:
-                                pass
-                        else:
-                            try:
-                                await message.remove_reaction(emoji, payload.member)
-                                await channel.send(f"⚠️ <@{user_id}> 你已經選擇過職業了！", delete_after=5)
-                            except:
-                                pass
-                    else:
-                        try:
-                            await message.remove_reaction(emoji, payload.member)
-                            await channel.send(f"❌ <@{user_id}> 請先簽到再選擇職業！", delete_after=5)
-                        except:
-                            pass
-                return
+            status = await state_actors.event(event_id, guild_id).pick_profession(user_id, profession_name)
             
+            if status != "not_signed":
+                if status == "added":
+                    await update_user_profession(user_id, profession_name, guild_id)
+                    
+                    try:
+                        bonus = PROFESSION_BONUS.get(profession_name, 0)
+                        bonus_text = f"（獲得職業加成：+{bonus}積分）" if bonus > 0 else ""
+                        await channel.send(f"✅ <@{user_id}> 已選擇職業：**{profession_name}**{bonus_text}", delete_after=5)
+                    except:
+                        pass
+                else:
+                    try:
+                        await message.remove_reaction(emoji, payload.member)
+                        await channel.send(f"⚠️ <@{user_id}> 你已經選擇過職業了！", delete_after=5)
+                    except:
+                        pass
+            else:
+                try:
+                    await message.remove_reaction(emoji, payload.member)
+                    await channel.send(f"❌ <@{user_id}> 請先簽到再選擇職業！", delete_after=5)
+                except:
+                    pass
+            return
+        
     except Exception as e:
         print(f"處理反應錯誤: {e}")
         import traceback
         traceback.print_exc()
 
+@bot.event
+async def on_member_update(before, after):
+    """成員身分組變更時清除權限快取"""
+    permission_resolver.invalidate(after.guild.id, after.id)
+
+@bot.event
+async def on_member_remove(member):
+    permission_resolver.invalidate(member.guild.id, member.id)
+
+@bot.event
+async def on_guild_role_update(before, after):
+    """身分組權限變更會影響所有成員，清除整個伺服器的快取"""
+    permission_resolver.invalidate(after.guild.id)
+
+@bot.event
+async def on_guild_role_delete(role):
+    permission_resolver.invalidate(role.guild.id)
+
 # ========== 主程式 ==========
 
 def main():